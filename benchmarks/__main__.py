@@ -0,0 +1,122 @@
+"""
+Benchmarks the stages of `update_links` on a synthetic source tree.
+
+    python -m benchmarks run --dirs 50 --out results.json
+    python -m benchmarks compare before.json after.json
+"""
+
+import argparse
+import contextlib
+import io as pyio
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+from cmake_refactor import io, listeners
+
+from .generator import TreeConfig, generate_tree
+
+
+def best_of(repeat: int, fn) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(pyio.StringIO()):
+            fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(config: TreeConfig, repeat: int = 3) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        src_dir = generate_tree(tmp, config)
+        repo_root = tmp + "/"
+        files = io.find_files("CMakeLists.txt", os.path.join(repo_root, src_dir))
+
+        def parse():
+            for f in files:
+                io.walk_stream(io.get_token_stream(f), listeners.CommandListener())
+
+        def analyze():
+            targets = {}
+            hm = {}
+            for f in files:
+                io.parse_targets(f, targets, header_target_map=hm, repo_root=repo_root)
+            return targets, hm
+
+        def map_headers():
+            io.map_local_headers(*graphs.pop(), repo_root)
+
+        # map_local_headers modifies the graph so every run needs a new one
+        graphs = [analyze() for _ in range(repeat)]
+        results = {
+            "parse": best_of(repeat, parse),
+            "map_local_headers": best_of(repeat, map_headers),
+            "update_links": best_of(
+                repeat, lambda: io.update_links(src_dir, repo_root, cache=False)
+            ),
+        }
+
+    return {
+        "commit": git_commit(),
+        "config": config.to_json(),
+        "files": len(files),
+        "results": results,
+    }
+
+
+def compare(before: dict, after: dict) -> str:
+    lines = [f"{'Benchmark':<20}{'Before (s)':>12}{'After (s)':>12}{'Ratio':>8}"]
+    for name, old in before["results"].items():
+        new = after["results"].get(name)
+        if new is None:
+            continue
+        lines.append(f"{name:<20}{old:>12.3f}{new:>12.3f}{new / old:>8.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run")
+    defaults = TreeConfig()
+    for option, value in defaults.to_json().items():
+        run.add_argument(f"--{option.replace('_', '-')}", type=int, default=value)
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--out", help="Write the results as JSON to this file.")
+    diff = commands.add_parser("compare")
+    diff.add_argument("before")
+    diff.add_argument("after")
+    args = vars(parser.parse_args())
+
+    if args.pop("command") == "compare":
+        with open(args["before"]) as before, open(args["after"]) as after:
+            print(compare(json.load(before), json.load(after)))
+        return
+
+    repeat = args.pop("repeat")
+    out = args.pop("out")
+    results = run_benchmarks(TreeConfig(**args), repeat)
+    print(json.dumps(results, indent=2))
+    if out is not None:
+        with open(out, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
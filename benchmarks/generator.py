@@ -0,0 +1,125 @@
+"""
+Generates a synthetic source tree in the style of the Velox repo: every
+directory has a CMakeLists.txt with a number of targets, each with sources
+and matching headers side by side.
+
+Targets are split into `link_depth` layers, targets only include headers of
+and link against targets in lower layers so the longest chain of links is
+`link_depth` long.
+"""
+
+import os
+import random
+
+external_headers = [
+    "folly/String.h",
+    "fmt/format.h",
+    "glog/logging.h",
+    "gflags/gflags.h",
+    "boost/algorithm/string.hpp",
+]
+
+
+class TreeConfig:
+    def __init__(
+        self,
+        dirs: int = 10,
+        targets_per_dir: int = 3,
+        sources_per_target: int = 4,
+        headers_per_target: int = 4,
+        include_fanout: int = 4,
+        link_depth: int = 4,
+        seed: int = 42,
+    ) -> None:
+        self.dirs = dirs
+        self.targets_per_dir = targets_per_dir
+        self.sources_per_target = sources_per_target
+        self.headers_per_target = headers_per_target
+        self.include_fanout = include_fanout
+        self.link_depth = link_depth
+        self.seed = seed
+
+    def to_json(self) -> dict:
+        return dict(vars(self))
+
+
+def target_name(dir: int, target: int) -> str:
+    return f"velox_d{dir}_t{target}"
+
+
+def file_name(dir: int, target: int, file: int) -> str:
+    return f"D{dir}T{target}File{file}"
+
+
+def generate_tree(root: str, config: TreeConfig) -> str:
+    """
+    Write the tree into `root`, returns the source dir relative to `root`.
+    """
+    rng = random.Random(config.seed)
+    targets = [
+        (d, t) for d in range(config.dirs) for t in range(config.targets_per_dir)
+    ]
+    n_files = max(config.sources_per_target, config.headers_per_target)
+    layer = {
+        target: i * config.link_depth // len(targets)
+        for i, target in enumerate(targets)
+    }
+
+    def headers_of(target):
+        d, t = target
+        return [
+            f"velox/dir{d}/{file_name(d, t, f)}.h"
+            for f in range(config.headers_per_target)
+        ]
+
+    with open(os.path.join(root, "CMakeLists.txt"), "w") as cml:
+        cml.write("cmake_minimum_required(VERSION 3.18)\nproject(Synthetic)\n")
+        cml.write("add_subdirectory(velox)\n")
+
+    os.makedirs(os.path.join(root, "velox"), exist_ok=True)
+    with open(os.path.join(root, "velox", "CMakeLists.txt"), "w") as cml:
+        for d in range(config.dirs):
+            cml.write(f"add_subdirectory(dir{d})\n")
+
+    for d in range(config.dirs):
+        dir = os.path.join(root, "velox", f"dir{d}")
+        os.makedirs(dir, exist_ok=True)
+        cml_lines = ["set(SOME_OPTION ON)", ""]
+
+        for t in range(config.targets_per_dir):
+            target = (d, t)
+            lower = [o for o in targets if layer[o] == layer[target] - 1]
+            deps = rng.sample(lower, min(len(lower), config.include_fanout))
+            sources = []
+
+            for f in range(n_files):
+                name = file_name(d, t, f)
+                includes = [h for dep in deps for h in headers_of(dep)[:1]]
+                includes.append(rng.choice(external_headers))
+                if f < config.headers_per_target:
+                    with open(os.path.join(dir, name + ".h"), "w") as header:
+                        header.write("#pragma once\n\n")
+                        for inc in includes[:1]:
+                            header.write(f'#include "{inc}"\n')
+                        header.write(f"\nint {name}();\n")
+
+                if f < config.sources_per_target:
+                    sources.append(name + ".cpp")
+                    with open(os.path.join(dir, name + ".cpp"), "w") as source:
+                        if f < config.headers_per_target:
+                            source.write(f'#include "velox/dir{d}/{name}.h"\n')
+                        for inc in includes:
+                            source.write(f"#include <{inc}>\n")
+                        source.write(f"\nint {name}() {{ return {f}; }}\n")
+
+            links = [target_name(*dep) for dep in deps] + ["Folly::folly"]
+            cml_lines.append(f"add_library({target_name(*target)} {' '.join(sources)})")
+            cml_lines.append(
+                f"target_link_libraries({target_name(*target)} {' '.join(links)})"
+            )
+            cml_lines.append("")
+
+        with open(os.path.join(dir, "CMakeLists.txt"), "w") as cml:
+            cml.write("\n".join(cml_lines))
+
+    return "velox"
@@ -0,0 +1,77 @@
+"""
+Compares reading the whole file with the streaming include extraction that
+stops after the preamble, on large synthetic sources.
+
+    python -m benchmarks.includes --files 20 --size-mb 4
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+
+from cmake_refactor import includes
+
+
+def write_source(path: str, size: int, n_includes: int = 30):
+    with open(path, "w") as file:
+        file.write("// Copyright header\n/*\n * a block comment\n */\n#pragma once\n\n")
+        for i in range(n_includes):
+            file.write(f'#include "velox/common/Header{i}.h"\n')
+            file.write(f"#include <folly/Header{i}.h>\n")
+        file.write("\nnamespace facebook::velox {\n")
+        line = "  int value = compute(argument_one, argument_two) * 42; // body\n"
+        for _ in range(size // len(line)):
+            file.write(line)
+        file.write("} // namespace facebook::velox\n")
+
+
+def read_whole(path: str) -> tuple[list[str], list[str]]:
+    # the extraction as it was before, reading the entire file
+    ptrn = re.compile(includes.include_ptrn.pattern, re.IGNORECASE | re.MULTILINE)
+    with open(path, "r") as file:
+        return includes.split_includes(ptrn.findall(file.read()))
+
+
+def read_streaming(path: str) -> tuple[tuple, int]:
+    with open(path, "r") as file:
+        found = includes.read_includes(file, preamble=True)
+        bytes_read = file.buffer.raw.tell()
+    return includes.split_includes(found), bytes_read
+
+
+def run(files: int, size_mb: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, f"source{i}.cpp") for i in range(files)]
+        for path in paths:
+            write_source(path, int(size_mb * 1024 * 1024))
+
+        start = time.perf_counter()
+        expected = [read_whole(path) for path in paths]
+        whole_time = time.perf_counter() - start
+        whole_bytes = sum(os.path.getsize(path) for path in paths)
+
+        start = time.perf_counter()
+        results = [read_streaming(path) for path in paths]
+        streaming_time = time.perf_counter() - start
+        streaming_bytes = sum(bytes_read for _, bytes_read in results)
+
+    if [found for found, _ in results] != expected:
+        raise Exception("Streaming extraction returned different includes!")
+
+    return {
+        "files": files,
+        "size_mb": size_mb,
+        "whole": {"seconds": whole_time, "bytes_read": whole_bytes},
+        "streaming": {"seconds": streaming_time, "bytes_read": streaming_bytes},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--size-mb", type=float, default=4)
+    args = parser.parse_args()
+    print(json.dumps(run(args.files, args.size_mb), indent=2))
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import sqlite3
+from importlib import metadata
+
+from .parser.CMakeLexer import serializedATN as lexer_atn
+from .parser.CMakeParser import serializedATN as parser_atn
+
+# bump when the format of the stored data changes
+CACHE_FORMAT = 2
+
+
+def tool_version() -> str:
+    try:
+        return metadata.version("cmake-refactor")
+    except metadata.PackageNotFoundError:
+        return "dev"
+
+
+def cache_version() -> str:
+    """
+    Identifies the tool and grammar the cached data was created with,
+    a change of either invalidates the entire cache.
+    """
+    grammar = hashlib.blake2b(
+        json.dumps([lexer_atn(), parser_atn()]).encode(), digest_size=16
+    ).hexdigest()
+    return f"{CACHE_FORMAT}:{tool_version()}:{grammar}"
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+
+
+class Cache:
+    """
+    Persistent cache for the per file results of a run, e.g. the target
+    commands of a CMakeLists.txt or the includes of a source file.
+
+    Entries are stored under a `kind` and the path of the file they were
+    created from. An entry is valid as long as the file has the same mtime and
+    size. If only the mtime changed (e.g. after a checkout) the content hash
+    is compared before the entry is discarded.
+    """
+
+    def __init__(self, cache_dir: str = ".cmr_cache") -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, "cache.sqlite"))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "kind TEXT, path TEXT, mtime INTEGER, size INTEGER, hash TEXT, data TEXT, "
+            "PRIMARY KEY (kind, path))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, data TEXT)"
+        )
+        self.hits = 0
+        self.misses = 0
+
+        version = cache_version()
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != version:
+            self.db.execute("DELETE FROM files")
+            self.db.execute("DELETE FROM state")
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,)
+            )
+            self.db.commit()
+
+    def get(self, kind: str, path: str):
+        row = self.db.execute(
+            "SELECT mtime, size, hash, data FROM files WHERE kind = ? AND path = ?",
+            (kind, path),
+        ).fetchone()
+        stat = os.stat(path)
+
+        if row is not None:
+            mtime, size, hash, data = row
+            if mtime == stat.st_mtime_ns and size == stat.st_size:
+                self.hits += 1
+                return json.loads(data)
+
+            if size == stat.st_size and hash == file_hash(path):
+                self.db.execute(
+                    "UPDATE files SET mtime = ? WHERE kind = ? AND path = ?",
+                    (stat.st_mtime_ns, kind, path),
+                )
+                self.hits += 1
+                return json.loads(data)
+
+        self.misses += 1
+        return None
+
+    def put(self, kind: str, path: str, data) -> None:
+        stat = os.stat(path)
+        self.db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                kind,
+                path,
+                stat.st_mtime_ns,
+                stat.st_size,
+                file_hash(path),
+                json.dumps(data),
+            ),
+        )
+
+    def get_state(self, name: str):
+        """
+        Data stored with `put_state`, this is not tied to a file but still
+        invalidated with the rest of the cache.
+        """
+        row = self.db.execute(
+            "SELECT data FROM state WHERE name = ?", (name,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_state(self, name: str, data) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO state VALUES (?, ?)", (name, json.dumps(data))
+        )
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+
+def open_cache(
+    repo_root: str, cache_dir: str | None = None, create: bool = True
+) -> Cache | None:
+    """
+    The cache of a run on `repo_root`, in `cache_dir` if given. The default
+    `.cmr_cache` in the repo root is only created with `create` (by runs
+    that write to the tree) and never for a repo root that doesn't exist,
+    otherwise it is only used if it exists already.
+    """
+    if cache_dir is not None:
+        return Cache(cache_dir)
+    default_dir = os.path.join(repo_root, ".cmr_cache")
+    if os.path.isdir(default_dir) or create and os.path.isdir(repo_root):
+        return Cache(default_dir)
+    return None
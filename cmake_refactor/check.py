@@ -0,0 +1,192 @@
+"""
+Checks the `target_link_libraries` calls without rewriting anything, only
+the commands of each file are needed so cached results are used as is and
+no token streams are kept.
+"""
+
+import json
+import os
+import sys
+from functools import partial
+from typing import NamedTuple, Optional
+
+from . import io, listeners
+from .cache import open_cache, tool_version
+
+scopes = {"PUBLIC", "PRIVATE", "INTERFACE"}
+
+rules = {
+    "missing-keyword": "`target_link_libraries` is called without a scope keyword",
+    "scope-mismatch": "The linked targets or their scopes differ from the ones "
+    "computed from the sources",
+}
+
+
+class Finding(NamedTuple):
+    rule: str
+    file: str
+    line: int
+    target: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.file}:{self.line}: [{self.rule}] {self.message}"
+
+
+class FailFast(Exception):
+    pass
+
+
+class Checker:
+    def __init__(self, repo_root: str, fail_fast: bool = False) -> None:
+        self.repo_root = repo_root
+        self.fail_fast = fail_fast
+        self.findings: list[Finding] = []
+
+    def add(self, rule: str, file: str, command: listeners.TargetCommand, msg: str):
+        path = os.path.relpath(file, self.repo_root)
+        self.findings.append(Finding(rule, path, command.line, command.args[0], msg))
+        if self.fail_fast:
+            raise FailFast()
+
+    def check_keywords(self, file: str, commands: list[listeners.TargetCommand]):
+        for command in commands:
+            if command.command != "target_link_libraries" or not command.args:
+                continue
+            if not scopes.intersection(command.args):
+                self.add(
+                    "missing-keyword",
+                    file,
+                    command,
+                    f"`{command.args[0]}` is linked without PUBLIC, PRIVATE "
+                    "or INTERFACE",
+                )
+
+    def check_scopes(
+        self,
+        file: str,
+        commands: list[listeners.TargetCommand],
+        targets: dict[str, listeners.TargetNode],
+    ):
+        update_listener = listeners.UpdateTargetsListener(targets)
+        by_start = {c.start + 2: c for c in commands}
+        update_listener.replay(commands)
+        for edit in update_listener.edits:
+            command = by_start.get(edit.start)
+            if edit.kind != "replace" or command is None:
+                continue
+            if edit.text.split() != command.args:
+                self.add(
+                    "scope-mismatch",
+                    file,
+                    command,
+                    f"expected `target_link_libraries({edit.text})`",
+                )
+
+
+def to_json(findings: list[Finding]) -> dict:
+    return {"findings": [f._asdict() for f in findings]}
+
+
+def to_sarif(findings: list[Finding]) -> dict:
+    return {
+        "version": "2.1.0",
+        "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+        "runs": [
+            {
+                "tool": {
+                    "driver": {
+                        "name": "cmake-refactor",
+                        "version": tool_version(),
+                        "rules": [
+                            {"id": id, "shortDescription": {"text": text}}
+                            for id, text in rules.items()
+                        ],
+                    }
+                },
+                "results": [
+                    {
+                        "ruleId": f.rule,
+                        "level": "error",
+                        "message": {"text": f.message},
+                        "locations": [
+                            {
+                                "physicalLocation": {
+                                    "artifactLocation": {"uri": f.file},
+                                    "region": {"startLine": f.line},
+                                }
+                            }
+                        ],
+                    }
+                    for f in findings
+                ],
+            }
+        ],
+    }
+
+
+def check(
+    src_dir: str,
+    repo_root: str,
+    excluded_dirs: list[str] = [],
+    cache: bool = True,
+    cache_dir: Optional[str] = None,
+    include_preamble: bool = False,
+    compile_commands: Optional[str] = None,
+    fail_fast: bool = False,
+    format: str = "text",
+    output: Optional[str] = None,
+    ignore_files: bool = False,
+    deps_config: Optional[str] = None,
+):
+    """
+    Check that every `target_link_libraries` call uses scope keywords and
+    links the targets `update-links` would, without changing any file.
+    `format` is one of text, json or sarif. Exits with 1 if anything was
+    found, with `fail_fast` after the first finding.
+    """
+    if format not in ["text", "json", "sarif"]:
+        raise ValueError(f"Unknown format `{format}`")
+
+    repo_root = os.path.abspath(repo_root) + "/"
+    files = io.find_files(
+        "CMakeLists.txt", os.path.join(repo_root, src_dir), excluded_dirs, ignore_files
+    )
+    file_cache = None
+    if cache:
+        file_cache = open_cache(repo_root, cache_dir, create=False)
+    checker = Checker(repo_root, fail_fast)
+
+    log = partial(print, file=sys.stderr)
+    try:
+        file_commands = io.read_commands(files, file_cache, log)
+        # keywords can be checked before the graph is complete
+        for f, commands in file_commands.items():
+            checker.check_keywords(f, commands)
+        scanner = io.include_scanner(file_cache, include_preamble, compile_commands)
+        targets, _ = io.build_graph(file_commands, repo_root, scanner, deps_config, log)
+
+        for f, commands in file_commands.items():
+            checker.check_scopes(f, commands, targets)
+    except FailFast:
+        pass
+    finally:
+        if file_cache is not None:
+            file_cache.close()
+
+    findings = checker.findings
+    if format == "text":
+        text = "".join(f"{f}\n" for f in findings)
+        text += f"{len(findings)} findings in {len(files)} files\n"
+    else:
+        report = to_json(findings) if format == "json" else to_sarif(findings)
+        text = json.dumps(report, indent=2) + "\n"
+
+    if output is None:
+        sys.stdout.write(text)
+    else:
+        with open(output, "w") as file:
+            file.write(text)
+
+    if findings:
+        raise SystemExit(1)
@@ -1,6 +1,170 @@
+"""
+The `cmr` commands. They only wrap the functions doing the work and import
+them when called, loading the parser takes longer than most commands that
+don't need it (e.g. `--help` or `cmr client`). The signatures have to match
+the wrapped functions.
+"""
+
+from typing import Optional
+
 import typer
-from . import io
+
+from . import client
 
 cli = typer.Typer()
 
-cli.command()(io.update_links)
+
+@cli.command("update-links")
+def update_links(
+    src_dir: str,
+    repo_root: str,
+    excluded_dirs: list[str] = [],
+    dry_run: bool = True,
+    parse_cache_mb: int = 512,
+    jobs: int = 1,
+    cache: bool = True,
+    cache_dir: Optional[str] = None,
+    include_preamble: bool = False,
+    compile_commands: Optional[str] = None,
+    profile: Optional[str] = None,
+    cprofile: Optional[str] = None,
+    incremental: bool = False,
+    since: Optional[str] = None,
+    changed: list[str] = [],
+    keep_going: bool = False,
+    write_threads: int = 4,
+    scan_threads: int = 8,
+    diff: Optional[str] = None,
+    ignore_files: bool = False,
+    deps_config: Optional[str] = None,
+    graph: Optional[str] = None,
+):
+    """
+    Update the `target_link_libraries` calls of all targets in SRC_DIR to
+    the targets their sources and headers use.
+
+    `excluded_dirs` are gitignore style patterns relative to SRC_DIR, with
+    `ignore_files` the `.gitignore` and `.ignore` files are honoured too.
+
+    With `incremental` only the targets affected by files changed since the
+    last run that wrote its results are updated. Changed files are found by
+    their mtime, or given by `since` (a git revision) or `changed`.
+
+    With `keep_going` all syntax errors are reported at the end instead of
+    the first one, nothing is updated if there are any. `diff` writes the changes as a patch to a file (`-` for stdout).
+
+    Sources and headers are scanned for includes in `scan_threads` threads.
+    With `include_preamble` only their includes up to the first line of code
+    are read, which misses includes further down (e.g. of `-inl.h` headers).
+
+    `deps_config` is a TOML file mapping external includes to the targets
+    providing them, replacing the packaged one.
+
+    `graph` is a graph written by `cmr analyze` to use instead of analyzing
+    the tree again.
+    """
+    args = locals()
+    from . import io
+
+    io.update_links(**args)
+
+
+@cli.command()
+def check(
+    src_dir: str,
+    repo_root: str,
+    excluded_dirs: list[str] = [],
+    cache: bool = True,
+    cache_dir: Optional[str] = None,
+    include_preamble: bool = False,
+    compile_commands: Optional[str] = None,
+    fail_fast: bool = False,
+    format: str = "text",
+    output: Optional[str] = None,
+    ignore_files: bool = False,
+    deps_config: Optional[str] = None,
+):
+    """
+    Check that every `target_link_libraries` call uses scope keywords and
+    links the targets `update-links` would, without changing any file.
+    `format` is one of text, json or sarif. Exits with 1 if anything was
+    found, with `fail_fast` after the first finding.
+    """
+    args = locals()
+    from . import check
+
+    check.check(**args)
+
+
+@cli.command()
+def analyze(
+    src_dir: str,
+    repo_root: str,
+    out: str = "graph.jsonl",
+    excluded_dirs: list[str] = [],
+    cache: bool = True,
+    cache_dir: Optional[str] = None,
+    include_preamble: bool = False,
+    compile_commands: Optional[str] = None,
+    ignore_files: bool = False,
+    deps_config: Optional[str] = None,
+):
+    """
+    Build the target graph of SRC_DIR and write it to `out`, as msgpack if
+    it ends in `.msgpack` and as JSON lines otherwise. `update-links --graph`
+    can start from it instead of analyzing the tree again.
+    """
+    args = locals()
+    from . import graph
+
+    graph.analyze(**args)
+
+
+@cli.command()
+def serve(
+    src_dir: str,
+    repo_root: str,
+    excluded_dirs: list[str] = [],
+    socket_path: Optional[str] = None,
+    interval: float = 1.0,
+    include_preamble: bool = False,
+    compile_commands: Optional[str] = None,
+    ignore_files: bool = False,
+    deps_config: Optional[str] = None,
+):
+    """
+    Keep the tree loaded and answer `update` and `check` requests of
+    `cmr client` on a Unix socket. The tree is polled for changes every
+    `interval` seconds while idle and before every request.
+    `ignore_files` and `deps_config` are the same as for `update-links`.
+    """
+    args = locals()
+    from . import daemon
+
+    daemon.serve(**args)
+
+
+@cli.command()
+def watch(
+    src_dir: str,
+    repo_root: str,
+    excluded_dirs: list[str] = [],
+    interval: float = 1.0,
+    dry_run: bool = False,
+    include_preamble: bool = False,
+    compile_commands: Optional[str] = None,
+    ignore_files: bool = False,
+    deps_config: Optional[str] = None,
+):
+    """
+    Keep the tree loaded and update the links whenever a CMakeLists.txt or
+    a scanned file changes, polling every `interval` seconds.
+    `ignore_files` and `deps_config` are the same as for `update-links`.
+    """
+    args = locals()
+    from . import daemon
+
+    daemon.watch(**args)
+
+
+cli.command("client")(client.request)
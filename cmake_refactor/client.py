@@ -0,0 +1,44 @@
+"""
+Thin client for `cmr serve`, only uses the standard library so it starts
+without loading the parser.
+"""
+
+import json
+import os
+import socket
+from typing import Optional
+
+
+def default_socket(repo_root: str) -> str:
+    return os.path.join(repo_root, ".cmr_cache", "daemon.sock")
+
+
+def send_request(path: str, request: dict) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(path)
+        conn.sendall(json.dumps(request).encode() + b"\n")
+        with conn.makefile("rb") as response:
+            return json.loads(response.readline())
+
+
+def request(
+    command: str,
+    repo_root: str = ".",
+    socket_path: Optional[str] = None,
+    dry_run: bool = False,
+):
+    """
+    Send `update` or `check` to a running `cmr serve` (or `stop` it). Exits
+    with 1 if the request failed or `check` found files that need an update.
+    """
+    path = socket_path or default_socket(os.path.abspath(repo_root) + "/")
+    response = send_request(path, {"command": command, "dry_run": dry_run})
+    if not response["ok"]:
+        print(response["error"])
+        raise SystemExit(1)
+
+    for f in response.get("changed", []):
+        print(f"{'Outdated' if command == 'check' else 'Updated'}: {f}")
+    print(f"Done in {response['seconds']:.3f}s")
+    if command == "check" and response["changed"]:
+        raise SystemExit(1)
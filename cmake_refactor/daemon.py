@@ -0,0 +1,304 @@
+import json
+import os
+import socketserver
+import time
+from typing import Optional
+
+import antlr4 as ant
+
+from . import io, listeners
+from .client import default_socket
+from .incremental import fingerprint
+
+
+class Session:
+    """
+    Keeps everything needed to update the links of a tree in memory: the
+    target commands and token stream of every CMakeLists.txt and the
+    includes of every scanned file.
+
+    `refresh` polls the fingerprints of these files and only re-parses or
+    re-scans the ones that changed. The target graph itself is cheap to
+    rebuild from the recorded commands and is rebuilt when anything changed,
+    as resolving the includes modifies the targets in place.
+
+    A CMakeLists.txt with syntax errors is dropped until it changes again,
+    nothing is planned or written while any file is broken.
+
+    The `deps_config` is loaded again for every analysis so the unknown
+    dependencies reported are the ones of the current tree.
+    """
+
+    def __init__(
+        self,
+        src_dir: str,
+        repo_root: str,
+        excluded_dirs: list[str] = [],
+        include_preamble: bool = False,
+        compile_commands: Optional[str] = None,
+        ignore_files: bool = False,
+        deps_config: Optional[str] = None,
+    ) -> None:
+        self.repo_root = os.path.abspath(repo_root) + "/"
+        self.src_dir = os.path.join(self.repo_root, src_dir)
+        self.excluded_dirs = excluded_dirs
+        self.ignore_files = ignore_files
+        self.deps_config = deps_config
+        self.scanner = io.include_scanner(None, include_preamble, compile_commands)
+        self.files: list[str] = []
+        self.commands: dict[str, list[listeners.TargetCommand]] = {}
+        self.streams: dict[str, ant.CommonTokenStream] = {}
+        self.texts: dict[str, str] = {}
+        self.fingerprints: dict[str, list[int] | None] = {}
+        # files that failed to parse with their fingerprint at the time
+        self.failed: dict[str, tuple[list[int] | None, listeners.ParseFailed]] = {}
+        # new texts of the files that need an update, `None` if outdated
+        self.updated: dict[str, str] | None = None
+        try:
+            self.refresh()
+        except listeners.ParseFailed as e:
+            print(e)
+
+    def parse(self, file: str):
+        # taken before reading, a change while parsing is picked up next time
+        current = fingerprint(file)
+        stream = io.get_token_stream(file)
+        stream.fill()
+        try:
+            commands = io.parse_commands(stream, keep_going=True)
+        except listeners.ParseFailed as e:
+            for cache in [self.commands, self.streams, self.texts]:
+                cache.pop(file, None)
+            self.failed[file] = (current, e)
+            return
+        self.failed.pop(file, None)
+        self.fingerprints[file] = current
+        self.commands[file] = commands
+        self.streams[file] = stream
+        self.texts[file] = io.stream_text(stream)
+
+    def check_failed(self):
+        if self.failed:
+            raise listeners.ParseFailed(
+                [error for _, e in self.failed.values() for error in e.errors]
+            )
+
+    def refresh(self) -> set[str]:
+        """
+        Pick up changes to the tree since the last refresh, returns the
+        changed files. Raises `ParseFailed` if any CMakeLists.txt has syntax
+        errors, after the rest of the tree was refreshed.
+        """
+        files = io.find_files(
+            "CMakeLists.txt", self.src_dir, self.excluded_dirs, self.ignore_files
+        )
+        changed = set(self.files).symmetric_difference(files)
+        changed.update(
+            f
+            for f in [*files, *self.scanner.includes, *self.scanner.headers]
+            if f in self.fingerprints and fingerprint(f) != self.fingerprints[f]
+        )
+        changed.update(
+            f for f, (last, _) in self.failed.items() if fingerprint(f) != last
+        )
+        if changed:
+            self.updated = None
+
+        for f in changed:
+            # re-recorded when the file is parsed or scanned again
+            self.fingerprints.pop(f, None)
+            if f in self.scanner.headers:
+                del self.scanner.headers[f]
+            if f in self.scanner.includes:
+                del self.scanner.includes[f]
+            # new or removed files change the header listing of their dir
+            self.scanner.headers.pop(os.path.dirname(f), None)
+            if f not in files:
+                for cache in [self.commands, self.streams, self.texts, self.failed]:
+                    cache.pop(f, None)
+
+        for f in files:
+            if f in changed or f not in self.commands and f not in self.failed:
+                print(f"Parsing: {f}")
+                self.parse(f)
+
+        self.files = files
+        self.check_failed()
+        return changed
+
+    def analyze(self) -> dict[str, listeners.TargetNode]:
+        file_commands = {f: self.commands[f] for f in self.files}
+        targets, _ = io.build_graph(
+            file_commands, self.repo_root, self.scanner, self.deps_config
+        )
+        # scanned files and directories are watched from now on
+        for f in [*self.scanner.includes, *self.scanner.headers]:
+            if f not in self.fingerprints:
+                self.fingerprints[f] = fingerprint(f)
+        return targets
+
+    def plan(self) -> dict[str, str]:
+        """
+        The new text of every CMakeLists.txt that needs an update.
+        """
+        self.check_failed()
+        if self.updated is not None:
+            return self.updated
+
+        targets = self.analyze()
+        self.updated = {}
+        for f in self.files:
+            update_listener = listeners.UpdateTargetsListener(targets)
+            update_listener.replay(self.commands[f])
+            text = io.apply_edits(self.streams[f], update_listener.edits)
+            if text != self.texts[f]:
+                self.updated[f] = text
+        return self.updated
+
+    def update(self, dry_run: bool = False) -> list[str]:
+        """
+        Update the links, returns the CMakeLists.txt that were (or with
+        `dry_run` would be) changed.
+        """
+        updated = self.plan()
+        if dry_run:
+            return sorted(updated)
+
+        for f, text in updated.items():
+            print(f"Updating: {f}")
+            io.write_file(f, text)
+            # our own changes do not have to be picked up by `refresh`, this
+            # includes the directory as the file is replaced
+            self.parse(f)
+            dir = os.path.dirname(f)
+            if dir in self.fingerprints:
+                self.fingerprints[dir] = fingerprint(dir)
+        self.updated = {}
+        return sorted(updated)
+
+    def handle(self, request: dict) -> dict:
+        self.refresh()
+        command = request.get("command")
+        if command == "update":
+            changed = self.update(dry_run=request.get("dry_run", False))
+        elif command == "check":
+            changed = self.update(dry_run=True)
+        else:
+            raise ValueError(f"Unknown command `{command}`")
+        return {"ok": True, "changed": changed}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        start = time.perf_counter()
+        try:
+            request = json.loads(line)
+            if request.get("command") == "stop":
+                self.server.stopped = True
+                response = {"ok": True}
+            else:
+                response = self.server.session.handle(request)
+        except Exception as e:
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        response["seconds"] = time.perf_counter() - start
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class Server(socketserver.UnixStreamServer):
+    def __init__(self, path: str, session: Session, interval: float) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        super().__init__(path, RequestHandler)
+        self.session = session
+        self.stopped = False
+        self.timeout = interval
+
+    def handle_timeout(self):
+        try:
+            self.session.refresh()
+        except listeners.ParseFailed as e:
+            print(e)
+
+    def run(self):
+        try:
+            while not self.stopped:
+                self.handle_request()
+        finally:
+            self.server_close()
+            os.remove(self.server_address)
+
+
+def serve(
+    src_dir: str,
+    repo_root: str,
+    excluded_dirs: list[str] = [],
+    socket_path: Optional[str] = None,
+    interval: float = 1.0,
+    include_preamble: bool = False,
+    compile_commands: Optional[str] = None,
+    ignore_files: bool = False,
+    deps_config: Optional[str] = None,
+):
+    """
+    Keep the tree loaded and answer `update` and `check` requests of
+    `cmr client` on a Unix socket. The tree is polled for changes every
+    `interval` seconds while idle and before every request.
+    `ignore_files` and `deps_config` are the same as for `update-links`.
+    """
+    session = Session(
+        src_dir,
+        repo_root,
+        excluded_dirs,
+        include_preamble,
+        compile_commands,
+        ignore_files,
+        deps_config,
+    )
+    path = socket_path or default_socket(session.repo_root)
+    server = Server(path, session, interval)
+    print(f"Serving on {path}")
+    server.run()
+
+
+def watch(
+    src_dir: str,
+    repo_root: str,
+    excluded_dirs: list[str] = [],
+    interval: float = 1.0,
+    dry_run: bool = False,
+    include_preamble: bool = False,
+    compile_commands: Optional[str] = None,
+    ignore_files: bool = False,
+    deps_config: Optional[str] = None,
+):
+    """
+    Keep the tree loaded and update the links whenever a CMakeLists.txt or
+    a scanned file changes, polling every `interval` seconds.
+    `ignore_files` and `deps_config` are the same as for `update-links`.
+    """
+    session = Session(
+        src_dir,
+        repo_root,
+        excluded_dirs,
+        include_preamble,
+        compile_commands,
+        ignore_files,
+        deps_config,
+    )
+    changed = True
+    try:
+        while True:
+            try:
+                if changed:
+                    session.update(dry_run)
+                time.sleep(interval)
+                changed = session.refresh()
+            except listeners.ParseFailed as e:
+                print(e)
+                # retried once the broken files changed
+                changed = False
+    except KeyboardInterrupt:
+        pass
+
@@ -0,0 +1,140 @@
+from collections.abc import MutableMapping
+from typing import Callable, Iterable
+
+from . import listeners
+
+
+class DependencyIndex(MutableMapping):
+    """
+    Maps headers to the targets a user of the header has to link against.
+
+    For most headers these are the targets that list the header (or its
+    source) but headers that are not part of any target still need the
+    targets of the headers they include. `resolve` computes this closure for
+    all of them in one pass.
+
+    Target lists are `OrderedSet`s so adding the same target twice has no
+    effect. It can be used like the plain dict it replaces.
+    """
+
+    def __init__(self, owners: dict | None = None) -> None:
+        self.owners: dict[str, listeners.OrderedSet] = {}
+        # headers without owner that include each other
+        self.cycles: list[list[str]] = []
+        # includes of the headers without owner that were resolved
+        self.includes: dict[str, list[str]] = {}
+        if owners is not None:
+            self.update(owners)
+
+    def __getitem__(self, header: str) -> listeners.OrderedSet:
+        return self.owners[header]
+
+    def __setitem__(self, header: str, targets: Iterable[listeners.TargetNode]) -> None:
+        if not isinstance(targets, listeners.OrderedSet):
+            targets = listeners.OrderedSet(targets)
+        self.owners[header] = targets
+
+    def __delitem__(self, header: str) -> None:
+        del self.owners[header]
+
+    def __iter__(self):
+        return iter(self.owners)
+
+    def __len__(self) -> int:
+        return len(self.owners)
+
+    def lookup(self, headers: Iterable[str]) -> listeners.OrderedSet:
+        targets = listeners.OrderedSet()
+        for h in headers:
+            if h in self.owners:
+                targets.extend(self.owners[h])
+        return targets
+
+    def resolve(
+        self,
+        headers: Iterable[str],
+        scan: Callable[[str], tuple[Iterable[listeners.TargetNode], Iterable[str]]],
+    ) -> None:
+        """
+        Add the targets needed by each of `headers` that has no owner.
+
+        `scan` returns the targets a header needs directly (e.g. external
+        dependencies) and the headers it includes. The targets of a header are
+        its direct targets plus the targets of its includes, for includes
+        without owner this is their own closure.
+
+        The includes between headers without owner are walked once in
+        strongly connected components (Tarjan), which come out in reverse
+        topological order so the closure of every include is known when it
+        is needed. Components with more than one header are include cycles,
+        they are recorded in `cycles` and share one set of targets.
+        """
+        edges: dict[str, tuple[list[listeners.TargetNode], list[str]]] = {}
+        closure: dict[str, listeners.OrderedSet] = {}
+        index: dict[str, int] = {}
+        low: dict[str, int] = {}
+        stack: list[str] = []
+        on_stack: set[str] = set()
+
+        def successors(h: str) -> list[str]:
+            return [inc for inc in edges[h][1] if inc not in self.owners]
+
+        for root in headers:
+            if root in index or root in self.owners:
+                continue
+
+            work = [(root, 0)]
+            while work:
+                node, i = work.pop()
+                if i == 0:
+                    index[node] = low[node] = len(index)
+                    stack.append(node)
+                    on_stack.add(node)
+                    direct, includes = scan(node)
+                    edges[node] = (list(direct), list(includes))
+                    self.includes[node] = edges[node][1]
+                else:
+                    # returning from the successor visited last
+                    low[node] = min(low[node], low[successors(node)[i - 1]])
+
+                succs = successors(node)
+                for j in range(i, len(succs)):
+                    succ = succs[j]
+                    if succ not in index:
+                        work.append((node, j + 1))
+                        work.append((succ, 0))
+                        break
+                    elif succ in on_stack:
+                        low[node] = min(low[node], index[succ])
+                else:
+                    if low[node] == index[node]:
+                        self.close_component(node, stack, on_stack, edges, closure)
+
+        for h, targets in closure.items():
+            if targets:
+                self.owners[h] = targets
+
+    def close_component(self, node, stack, on_stack, edges, closure) -> None:
+        component = []
+        while True:
+            h = stack.pop()
+            on_stack.discard(h)
+            component.append(h)
+            if h == node:
+                break
+
+        targets = listeners.OrderedSet()
+        for h in component:
+            direct, includes = edges[h]
+            targets.extend(direct)
+            for inc in includes:
+                if inc in self.owners:
+                    targets.extend(self.owners[inc])
+                elif inc in closure:
+                    targets.extend(closure[inc])
+
+        for h in component:
+            closure[h] = targets
+
+        if len(component) > 1 or node in edges[node][1]:
+            self.cycles.append(sorted(component))
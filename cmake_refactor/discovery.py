@@ -0,0 +1,184 @@
+"""
+Finds files by name with `os.scandir`, skipping paths that match gitignore
+style patterns. Files are yielded while the walk is running so the caller
+can start working on them right away.
+"""
+
+import os
+import re
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+# ignore files honoured with `ignore_files=True`
+default_ignore_files = [".gitignore", ".ignore"]
+
+
+class Pattern(NamedTuple):
+    """
+    A gitignore style pattern, matched against paths relative to `base`.
+    """
+
+    regex: re.Pattern
+    base: str
+    negated: bool
+    dir_only: bool
+
+
+def translate(glob: str) -> str:
+    """
+    Regex for a glob where `*` and `?` don't match `/` and `**` matches any
+    number of directories.
+    """
+    regex = ""
+    i = 0
+    while i < len(glob):
+        if glob.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif glob.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif glob[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif glob[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif glob[i] == "[" and "]" in glob[i + 2 :]:
+            end = glob.index("]", i + 2)
+            chars = glob[i + 1 : end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            regex += "[" + chars.replace("\\", "\\\\") + "]"
+            i = end + 1
+        elif glob[i] == "\\" and i + 1 < len(glob):
+            regex += re.escape(glob[i + 1])
+            i += 2
+        else:
+            regex += re.escape(glob[i])
+            i += 1
+    return regex
+
+
+def parse_pattern(line: str, base: str) -> Optional[Pattern]:
+    """
+    Parse a line of an ignore file in the directory `base`, returns None for
+    empty lines and comments.
+    """
+    line = line.rstrip("\n")
+    if not line.endswith("\\ "):
+        line = line.rstrip()
+    if not line or line.startswith("#"):
+        return None
+
+    negated = line.startswith("!")
+    if negated or line.startswith("\\"):
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    # patterns with a slash are relative to `base`, others match at any depth
+    regex = translate(line.lstrip("/"))
+    if "/" not in line:
+        regex = "(?:.*/)?" + regex
+    return Pattern(re.compile(regex + r"\Z"), base, negated, dir_only)
+
+
+def match(patterns: list[Pattern], path: str, is_dir: bool) -> Optional[bool]:
+    """
+    Whether `path` is ignored according to the last matching pattern, None if
+    no pattern matches.
+    """
+    for pattern in reversed(patterns):
+        if pattern.dir_only and not is_dir:
+            continue
+        if not path.startswith(pattern.base):
+            continue
+        if pattern.regex.match(path, len(pattern.base)):
+            return not pattern.negated
+    return None
+
+
+def read_ignore_file(path: str) -> list[Pattern]:
+    base = os.path.dirname(path) + "/"
+    with open(path, "r", errors="replace") as file:
+        return [p for line in file if (p := parse_pattern(line, base))]
+
+
+def parent_ignore_files(dir: str, names: list[str]) -> list[Pattern]:
+    """
+    Patterns of the ignore files in the parents of `dir` up to the root of
+    the git repository, none if `dir` is not in a repository.
+    """
+    parents = []
+    parent = os.path.dirname(dir)
+    while True:
+        parents.append(parent)
+        if os.path.exists(os.path.join(parent, ".git")):
+            break
+        if os.path.dirname(parent) == parent:
+            return []
+        parent = os.path.dirname(parent)
+
+    patterns = []
+    for parent in reversed(parents):
+        for name in names:
+            path = os.path.join(parent, name)
+            if os.path.isfile(path):
+                patterns.extend(read_ignore_file(path))
+    return patterns
+
+
+def iter_files(
+    file_name: str,
+    root_dir: str,
+    exclude: Iterable[str] = (),
+    ignore_files: bool = False,
+) -> Iterator[str]:
+    """
+    Yield the files named exactly `file_name` below `root_dir`, in sorted
+    order with the files of a directory before its subdirectories.
+
+    `exclude` are gitignore style patterns relative to `root_dir`, a plain
+    name like `proto` skips every file or directory of that name. With
+    `ignore_files` the `.gitignore` and `.ignore` files in the tree and its
+    parents (up to the git root) are honoured as well, `exclude` takes
+    precedence over them. Like `os.walk` unreadable directories are skipped
+    and symlinked directories are not followed.
+    """
+    # patterns are matched against absolute paths, the yielded paths start
+    # with `root_dir` as given like the ones of `os.walk`
+    top = os.path.abspath(root_dir)
+    prefix = root_dir.rstrip("/")
+    excluded = [p for e in exclude if (p := parse_pattern(e, top + "/"))]
+    names = default_ignore_files if ignore_files else []
+    ignored = parent_ignore_files(top, names) if names else []
+
+    stack = [(top, ignored)]
+    while stack:
+        dir, ignored = stack.pop()
+        try:
+            with os.scandir(dir) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+
+        present = {e.name for e in entries}
+        for name in names:
+            if name in present:
+                ignored = ignored + read_ignore_file(os.path.join(dir, name))
+
+        subdirs = []
+        for entry in entries:
+            is_dir = entry.is_dir()
+            if not is_dir and entry.name != file_name:
+                continue
+            path = entry.path
+            skip = match(excluded, path, is_dir)
+            if skip is None:
+                skip = match(ignored, path, is_dir)
+            if skip:
+                continue
+            if not is_dir:
+                yield prefix + path[len(top) :]
+            elif not entry.is_symlink():
+                subdirs.append((path, ignored))
+        stack.extend(reversed(subdirs))
@@ -0,0 +1,298 @@
+"""
+Saves the target graph built by the analysis so other tools can query it
+and later runs can start from it.
+
+A graph file is a stream of records, as JSON lines or (with the optional
+`msgpack` package) msgpack, chosen by the file extension:
+
+- `["graph", version, repo_root]` first
+- `["s", text]` a string, ids count up from 0 in order of appearance
+- `["n", name, flags, cml_path, alias_for]` a node, ids count up from 0;
+  `flags` has bit 1 set for interface targets, bit 2 for object libraries
+  and bit 3 for the nodes that were in the dict of targets (not external
+  dependencies), `cml_path` and `alias_for` can be null
+- `["l", node, field, [ids]]` a file list (string ids) or target list (node
+  ids) of a node, `field` is an index into `fields`
+- `["h", header, [nodes]]` the targets of a header
+
+Strings and nodes are referenced by id and strings are written before
+their first use, so a file can be read in one pass.
+"""
+
+import json
+import os
+import sys
+from collections.abc import MutableMapping
+from typing import IO, Iterable, Iterator, Optional
+
+from . import io, listeners
+from .cache import open_cache
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+GRAPH_FORMAT = 1
+
+file_fields = ["headers", "sources", "cpp_includes", "h_includes"]
+target_fields = [
+    "public_targets",
+    "private_targets",
+    "ppublic_targets",
+    "pprivate_targets",
+    "interface_targets",
+]
+fields = file_fields + target_fields
+
+INTERFACE = 1
+OBJECT_LIB = 2
+LISTED = 4
+
+
+def graph_records(
+    targets: dict[str, listeners.TargetNode],
+    header_target_map: Optional[dict] = None,
+    repo_root: str = "",
+) -> Iterator[list]:
+    """
+    The records of the graph of `targets` including the nodes they reference
+    that are not part of `targets` (e.g. external dependencies).
+    """
+    yield ["graph", GRAPH_FORMAT, repo_root]
+
+    strings: dict[str, int] = {}
+
+    def string(text: str) -> Iterator[list]:
+        if text not in strings:
+            strings[text] = len(strings)
+            yield ["s", text]
+
+    nodes: dict[listeners.TargetNode, int] = {}
+    pending = list(targets.values())
+    if header_target_map is not None:
+        for targets_h in header_target_map.values():
+            pending.extend(targets_h)
+    # breadth first so the targets get the first ids, in their order
+    for node in pending:
+        if node in nodes:
+            continue
+        nodes[node] = len(nodes)
+        if node.alias_for is not None:
+            pending.append(node.alias_for)
+        for field in target_fields:
+            pending.extend(getattr(node, field))
+
+    for node in nodes:
+        yield from string(node.name)
+        if node.cml_path is not None:
+            yield from string(node.cml_path)
+        flags = INTERFACE * node.is_interface | OBJECT_LIB * node.is_object_lib
+        if targets.get(node.name) is node:
+            flags |= LISTED
+        yield [
+            "n",
+            strings[node.name],
+            flags,
+            None if node.cml_path is None else strings[node.cml_path],
+            None if node.alias_for is None else nodes[node.alias_for],
+        ]
+
+    for node, id in nodes.items():
+        for i, field in enumerate(fields):
+            items = getattr(node, field)
+            if not items:
+                continue
+            if field in file_fields:
+                for path in items:
+                    yield from string(path)
+                ids = [strings[path] for path in items]
+            else:
+                ids = [nodes[t] for t in items]
+            yield ["l", id, i, ids]
+
+    if header_target_map is not None:
+        for header, targets_h in header_target_map.items():
+            yield from string(header)
+            yield ["h", strings[header], [nodes[t] for t in targets_h]]
+
+
+def is_msgpack(path: str) -> bool:
+    if not path.endswith(".msgpack"):
+        return False
+    if msgpack is None:
+        raise ImportError("Reading or writing msgpack needs the `msgpack` package")
+    return True
+
+
+def write_graph(
+    path: str,
+    targets: dict[str, listeners.TargetNode],
+    header_target_map: Optional[dict] = None,
+    repo_root: str = "",
+):
+    records = graph_records(targets, header_target_map, repo_root)
+    if is_msgpack(path):
+        packer = msgpack.Packer()
+        with open(path, "wb") as file:
+            for record in records:
+                file.write(packer.pack(record))
+    else:
+        with open(path, "w") as file:
+            for record in records:
+                file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def read_records(file: IO[bytes], msgpack_format: bool) -> Iterable[list]:
+    if msgpack_format:
+        return msgpack.Unpacker(file, use_list=True)
+    return map(json.loads, file)
+
+
+class LazyTargetNode(listeners.TargetNode):
+    """
+    A node of a `Graph` whose file and target lists are only read from the
+    graph when they are first used.
+    """
+
+    __slots__ = ("graph", "id")
+
+    def __getattr__(self, slot: str):
+        # only called for slots that are not set yet
+        if slot.removeprefix("_") not in fields:
+            raise AttributeError(slot)
+        self.graph.fill(self)
+        return object.__getattribute__(self, slot)
+
+
+class Graph(MutableMapping):
+    """
+    The target graph in the file at `path`, it can be used like the dict of
+    targets it was written from. Nodes are only created when they are
+    accessed, directly or through an edge of another node.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.strings: list[str] = []
+        # name, flags, cml_path, alias_for
+        self.nodes: list[list] = []
+        self.lists: dict[int, list[tuple[int, list[int]]]] = {}
+        self.headers: list[tuple[int, list[int]]] = []
+        self.targets: dict[str, listeners.TargetNode] = {}
+        self.created: dict[int, LazyTargetNode] = {}
+        self.repo_root = ""
+
+        with open(path, "rb") as file:
+            records = iter(read_records(file, is_msgpack(path)))
+            header = next(records, None)
+            if header is None or header[0] != "graph" or header[1] != GRAPH_FORMAT:
+                raise ValueError(f"`{path}` is not a graph of version {GRAPH_FORMAT}")
+            self.repo_root = header[2]
+            for record in records:
+                kind = record[0]
+                if kind == "s":
+                    self.strings.append(sys.intern(record[1]))
+                elif kind == "n":
+                    self.nodes.append(record[1:])
+                elif kind == "l":
+                    self.lists.setdefault(record[1], []).append((record[2], record[3]))
+                elif kind == "h":
+                    self.headers.append((record[1], record[2]))
+
+        self.ids = {
+            self.strings[n[0]]: id
+            for id, n in enumerate(self.nodes)
+            if n[1] & LISTED
+        }
+
+    def node(self, id: int) -> LazyTargetNode:
+        node = self.created.get(id)
+        if node is not None:
+            return node
+
+        name, flags, cml_path, alias_for = self.nodes[id]
+        node = LazyTargetNode.__new__(LazyTargetNode)
+        self.created[id] = node
+        node.graph = self
+        node.id = id
+        node.name = self.strings[name]
+        node.is_interface = bool(flags & INTERFACE)
+        node.is_object_lib = bool(flags & OBJECT_LIB)
+        node.cml_path = None if cml_path is None else self.strings[cml_path]
+        node.alias_for = None if alias_for is None else self.node(alias_for)
+        node.was_linked = False
+        return node
+
+    def fill(self, node: LazyTargetNode):
+        for field in fields:
+            setattr(node, field, [])
+        for field, ids in self.lists.pop(node.id, []):
+            if fields[field] in file_fields:
+                setattr(node, fields[field], [self.strings[id] for id in ids])
+            else:
+                setattr(node, fields[field], [self.node(id) for id in ids])
+
+    def header_target_map(self) -> dict[str, list[listeners.TargetNode]]:
+        return {
+            self.strings[h]: [self.node(id) for id in ids] for h, ids in self.headers
+        }
+
+    def __getitem__(self, name: str) -> listeners.TargetNode:
+        node = self.targets.get(name)
+        if node is None:
+            node = self.node(self.ids[name])
+            self.targets[name] = node
+        return node
+
+    def __setitem__(self, name: str, node: listeners.TargetNode) -> None:
+        self.targets[name] = node
+        self.ids.pop(name, None)
+
+    def __delitem__(self, name: str) -> None:
+        self[name]
+        del self.targets[name]
+        self.ids.pop(name, None)
+
+    def __iter__(self):
+        yield from self.ids
+        yield from (name for name in self.targets if name not in self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids) + sum(name not in self.ids for name in self.targets)
+
+
+def analyze(
+    src_dir: str,
+    repo_root: str,
+    out: str = "graph.jsonl",
+    excluded_dirs: list[str] = [],
+    cache: bool = True,
+    cache_dir: Optional[str] = None,
+    include_preamble: bool = False,
+    compile_commands: Optional[str] = None,
+    ignore_files: bool = False,
+    deps_config: Optional[str] = None,
+):
+    """
+    Build the target graph of SRC_DIR and write it to `out`, as msgpack if
+    it ends in `.msgpack` and as JSON lines otherwise. `update-links --graph`
+    can start from it instead of analyzing the tree again.
+    """
+    repo_root = os.path.abspath(repo_root) + "/"
+    files = io.find_files(
+        "CMakeLists.txt", os.path.join(repo_root, src_dir), excluded_dirs, ignore_files
+    )
+    file_cache = None
+    if cache:
+        file_cache = open_cache(repo_root, cache_dir)
+
+    try:
+        file_commands = io.read_commands(files, file_cache)
+        scanner = io.include_scanner(file_cache, include_preamble, compile_commands)
+        targets, hm = io.build_graph(file_commands, repo_root, scanner, deps_config)
+    finally:
+        if file_cache is not None:
+            file_cache.close()
+
+    write_graph(out, targets, hm, repo_root)
+    print(f"Wrote {len(targets)} targets to {out}")
@@ -0,0 +1,329 @@
+import json
+import os
+import re
+import shlex
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from glob import glob
+from typing import Iterable
+
+from .cache import Cache
+from .profiling import Profiler
+
+include_ptrn = re.compile('^#include\\s+["<]([\\w/]+\\.h.*)[">]', flags=re.IGNORECASE)
+
+
+directive_ptrn = re.compile(r"#\s*(\w+)\s*(\w*)")
+
+
+def read_includes(lines: Iterable[str], preamble: bool = False) -> list[str]:
+    """
+    Collect the included headers from `lines`, which can be an open file
+    so only as much of it is read as necessary.
+
+    With `preamble` reading stops at the first line of code outside of an
+    `#if` block, i.e. a line that is not empty, a comment or a preprocessor
+    directive. An include guard doesn't count as a block. Includes after
+    the first code are missed (e.g. of an `-inl.h` header at the end of a
+    header, which is not part of any target) together with everything they
+    include, so this is off by default.
+    """
+    includes: list[str] = []
+    depth = 0
+    directives = 0
+    guard = None
+    in_comment = False
+    continued = False
+
+    for line in lines:
+        match = include_ptrn.match(line)
+        if match:
+            includes.append(match.group(1))
+            continue
+
+        if not preamble:
+            continue
+
+        stripped = line.strip()
+        was_continued = continued
+        continued = stripped.endswith("\\")
+        if was_continued:
+            continue
+        if in_comment:
+            in_comment = "*/" not in stripped
+        elif stripped.startswith("/*"):
+            in_comment = "*/" not in stripped
+        elif stripped.startswith("#"):
+            directive = directive_ptrn.match(stripped)
+            if directive is None:
+                continue
+            name, arg = directive.groups()
+            if name in ("if", "ifdef", "ifndef"):
+                depth += 1
+                if name == "ifndef" and directives == 0:
+                    guard = arg
+            elif name == "define" and directives == 1 and arg == guard:
+                depth -= 1
+            elif name == "endif":
+                depth = max(depth - 1, 0)
+            directives += 1
+        elif stripped and not stripped.startswith("//") and depth == 0:
+            break
+
+    return includes
+
+
+def split_includes(includes: list[str]) -> tuple[list[str], list[str]]:
+    return (
+        [h for h in includes if h.startswith("velox")],
+        [h for h in includes if not h.startswith("velox")],
+    )
+
+
+def get_includes(file_path: str, preamble: bool = False) -> tuple[list[str], list[str]]:
+    with open(file_path, "r") as file:
+        includes = read_includes(file, preamble)
+
+    return split_includes(includes)
+
+
+def read_depfile(path: str) -> list[str]:
+    """
+    Returns the dependencies of the first rule in a Makefile style depfile
+    as written by `-MD`/`-MMD`.
+    """
+    with open(path, "r") as file:
+        text = file.read().replace("\\\n", " ")
+
+    rule = re.split(r"(?<!\\)\n", text, maxsplit=1)[0]
+    deps = re.split(r"(?<!\\):\s", rule, maxsplit=1)[-1]
+    return [d.replace("\\ ", " ") for d in re.split(r"(?<!\\)\s+", deps) if d]
+
+
+class CompileCommands:
+    """
+    The dependencies of each source in a `compile_commands.json`, taken from
+    the depfiles the compiler wrote during the last build. Sources without
+    a depfile are not part of the index.
+
+    Depfiles list every header that was included, transitively and with
+    their resolved path, so they can't replace scanning the source. They
+    tell which of its includes were compiled though: includes in disabled
+    `#if` blocks are not in the depfile and are dropped by `filter`.
+
+    Depfiles written with `-MMD` leave out system headers, including the
+    ones found through `-isystem`, so only the project includes of these
+    sources are filtered.
+    """
+
+    def __init__(self, path: str) -> None:
+        # source -> file name -> paths of the dependencies with that name
+        self.deps: dict[str, dict[str, list[str]]] = {}
+        # sources whose depfile lists system headers too
+        self.with_system: set[str] = set()
+        with open(path, "r") as file:
+            entries = json.load(file)
+
+        for entry in entries:
+            directory = entry["directory"]
+            source = os.path.normpath(os.path.join(directory, entry["file"]))
+            args = entry.get("arguments") or shlex.split(entry["command"])
+            depfile = self.parse_args(args, directory)
+            if depfile is None and "output" in entry:
+                depfile = os.path.join(directory, entry["output"] + ".d")
+
+            if depfile is None or not os.path.exists(depfile):
+                continue
+
+            deps: dict[str, list[str]] = {}
+            for dep in read_depfile(depfile):
+                dep = os.path.normpath(os.path.join(directory, dep))
+                deps.setdefault(os.path.basename(dep), []).append(dep)
+            self.deps[source] = deps
+            if "-MMD" not in args and ("-MD" in args or "-M" in args):
+                self.with_system.add(source)
+
+    def parse_args(self, args: list[str], directory: str) -> str | None:
+        depfile = None
+        output = None
+        flags = iter(args)
+        for arg in flags:
+            if arg == "-MF":
+                depfile = next(flags, None)
+            elif arg.startswith("-MF"):
+                depfile = arg[len("-MF") :]
+            elif arg == "-o":
+                output = next(flags, None)
+
+        if depfile is None and output is not None:
+            depfile = output + ".d"
+        if depfile is not None:
+            depfile = os.path.join(directory, depfile)
+        return depfile
+
+    def filter(
+        self, source: str, includes: tuple[list[str], list[str]]
+    ) -> tuple[list[str], list[str]] | None:
+        """
+        The `includes` scanned from `source` that were compiled, `None` if
+        the source is not in the index. An include was compiled if a
+        dependency ends with its name, wherever the compiler found it.
+        """
+        source = os.path.normpath(source)
+        deps = self.deps.get(source)
+        if deps is None:
+            return None
+
+        def compiled(name: str) -> bool:
+            paths = deps.get(name.rsplit("/", 1)[-1], [])
+            return any(p.replace(os.path.sep, "/").endswith("/" + name) for p in paths)
+
+        deps_h = includes[1]
+        if source in self.with_system:
+            deps_h = [h for h in deps_h if compiled(h)]
+        return [h for h in includes[0] if compiled(h)], deps_h
+
+
+class IncludeScanner:
+    """
+    Scans files for includes and directories for headers. Both results are
+    memoized for the lifetime of the scanner as the same headers and
+    directories are reached through many targets.
+
+    If a `cache` is passed the includes of a file are also persisted across
+    runs. See `read_includes` for `preamble`. Includes of sources that are
+    in `compile_commands` are filtered to the ones that were compiled, the
+    cache keeps them unfiltered as depfiles change without the source.
+
+    `prefetch` reads files in `threads` threads with at most `max_pending`
+    reads in flight, everything else happens in the calling thread.
+    """
+
+    def __init__(
+        self,
+        cache: Cache | None = None,
+        preamble: bool = False,
+        compile_commands: CompileCommands | None = None,
+        profiler: Profiler | None = None,
+        threads: int = 8,
+        max_pending: int = 64,
+    ) -> None:
+        self.cache = cache
+        self.threads = threads
+        self.max_pending = max_pending
+        self.profiler = Profiler() if profiler is None else profiler
+        self.compile_commands = compile_commands
+        self.preamble = preamble
+        # results depend on the preamble so they are cached separately
+        self.cache_kind = "includes:preamble" if preamble else "includes"
+        self.includes: dict[str, tuple[list[str], list[str]]] = {}
+        self.headers: dict[str, frozenset[str]] = {}
+        self.include_hits = 0
+        self.include_misses = 0
+        # files that were actually read, not found in memory or the cache
+        self.files_read = 0
+        self.header_hits = 0
+        self.header_misses = 0
+        self.compile_hits = 0
+
+    def lookup(self, file_path: str) -> tuple[list[str], list[str]] | None:
+        """
+        The includes of a file if they are known without reading it.
+        """
+        includes = self.includes.get(file_path)
+        if includes is not None:
+            self.include_hits += 1
+            return includes
+
+        self.include_misses += 1
+        if self.cache is not None:
+            cached = self.cache.get(self.cache_kind, file_path)
+            if cached is not None:
+                return self.remember(file_path, (cached[0], cached[1]))
+        return None
+
+    def remember(
+        self, file_path: str, includes: tuple[list[str], list[str]]
+    ) -> tuple[list[str], list[str]]:
+        if self.compile_commands is not None:
+            compiled = self.compile_commands.filter(file_path, includes)
+            if compiled is not None:
+                self.compile_hits += 1
+                includes = compiled
+        self.includes[file_path] = includes
+        return includes
+
+    def store(
+        self, file_path: str, includes: tuple[list[str], list[str]]
+    ) -> tuple[list[str], list[str]]:
+        if self.cache is not None:
+            self.cache.put(self.cache_kind, file_path, includes)
+        return self.remember(file_path, includes)
+
+    def get_includes(self, file_path: str) -> tuple[list[str], list[str]]:
+        """
+        Same as `get_includes` but memoized, the returned lists must not be
+        modified.
+        """
+        includes = self.lookup(file_path)
+        if includes is None:
+            with self.profiler.phase("scan includes"):
+                includes = get_includes(file_path, self.preamble)
+            self.files_read += 1
+            includes = self.store(file_path, includes)
+        return includes
+
+    def prefetch(self, files: Iterable[str]):
+        """
+        Scan the files that are not known yet ahead of `get_includes`. Files
+        that can't be read are left to `get_includes` to raise.
+        """
+        if self.threads <= 1:
+            return
+
+        pending: deque[tuple[str, Future]] = deque()
+
+        def finish():
+            file_path, future = pending.popleft()
+            if future.exception() is None:
+                self.files_read += 1
+                self.store(file_path, future.result())
+
+        with self.profiler.phase("scan includes"), ThreadPoolExecutor(
+            self.threads
+        ) as pool:
+            for file_path in dict.fromkeys(files):
+                if file_path in self.includes:
+                    continue
+                try:
+                    if self.lookup(file_path) is not None:
+                        continue
+                except OSError:
+                    continue
+                if len(pending) >= self.max_pending:
+                    finish()
+                future = pool.submit(get_includes, file_path, self.preamble)
+                pending.append((file_path, future))
+            while pending:
+                finish()
+
+    def local_headers(self, dir: str) -> frozenset[str]:
+        """
+        Names of all headers in `dir`.
+        """
+        headers = self.headers.get(dir)
+        if headers is not None:
+            self.header_hits += 1
+            return headers
+
+        self.header_misses += 1
+        headers = frozenset(glob("*.h*", root_dir=dir))
+        self.headers[dir] = headers
+        return headers
+
+    def summary(self) -> str:
+        return (
+            f"Include scan: {self.include_hits} hits, {self.include_misses} misses; "
+            f"header listing: {self.header_hits} hits, {self.header_misses} misses; "
+            f"compile commands: {self.compile_hits} sources"
+        )
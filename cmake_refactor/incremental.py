@@ -0,0 +1,172 @@
+import os
+import subprocess
+
+from . import dependencies, listeners
+
+
+def fingerprint(path: str) -> list[int] | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def git_changed_files(repo_root: str, rev: str) -> set[str]:
+    """
+    Files that differ from `rev` in the working tree, including untracked
+    files, as absolute paths.
+    """
+    commands = [
+        ["git", "diff", "--name-only", "--relative", rev, "--"],
+        ["git", "ls-files", "--others", "--exclude-standard"],
+    ]
+    changed = set()
+    for command in commands:
+        out = subprocess.run(
+            command, cwd=repo_root, capture_output=True, text=True, check=True
+        ).stdout
+        changed.update(os.path.join(repo_root, f) for f in out.splitlines() if f)
+    return changed
+
+
+class RunState:
+    """
+    What an incremental run needs to know about the last run that wrote
+    its results: the fingerprints of all files it read and the reverse edges
+    of the graph, from files to the targets that are affected by them.
+
+    - `owners`: source or header (absolute) -> targets listing it
+    - `includers`: header (relative to the repo) -> targets including it,
+      directly or through headers without owner
+    - `cml_targets`: CMakeLists.txt -> targets with commands in that file
+    - `dependents`: target -> targets linking against it in the cml
+    """
+
+    def __init__(self, data: dict | None = None) -> None:
+        data = data or {}
+        self.files: dict[str, list[int] | None] = data.get("files", {})
+        self.owners: dict[str, list[str]] = data.get("owners", {})
+        self.includers: dict[str, list[str]] = data.get("includers", {})
+        self.cml_targets: dict[str, list[str]] = data.get("cml_targets", {})
+        self.dependents: dict[str, list[str]] = data.get("dependents", {})
+
+    def to_json(self) -> dict:
+        return {
+            "files": self.files,
+            "owners": self.owners,
+            "includers": self.includers,
+            "cml_targets": self.cml_targets,
+            "dependents": self.dependents,
+        }
+
+    def changed_files(self, cml_files: list[str]) -> set[str]:
+        """
+        Files whose mtime or size differ from the last run, `cml_files` are
+        the CMakeLists.txt found in this run so new ones are detected too.
+        """
+        changed = {f for f in cml_files if f not in self.files}
+        changed.update(f for f, last in self.files.items() if fingerprint(f) != last)
+        return changed
+
+    def affected_targets(
+        self,
+        changed: set[str],
+        targets: dict[str, listeners.TargetNode],
+        commands: dict[str, list[listeners.TargetCommand]],
+        repo_root: str,
+    ) -> set[str]:
+        """
+        Names of the targets whose links can differ from the last run due to
+        the `changed` files. This over-approximates, re-resolving a target
+        that did not change gives the same result.
+        """
+        affected: set[str] = set()
+        cml_affected: set[str] = set()
+
+        for path in changed:
+            affected.update(self.owners.get(path, []))
+            affected.update(self.includers.get(path.removeprefix(repo_root), []))
+            if path in self.cml_targets or path in commands:
+                cml_affected.update(self.cml_targets.get(path, []))
+                cml_affected.update(command_targets(commands.get(path, [])))
+
+        # the headers of a target in a changed cml may have moved between
+        # targets so all their users have to be resolved again
+        headers = {p for p, names in self.owners.items() if cml_affected & set(names)}
+        for name in cml_affected:
+            if name in targets:
+                headers.update(targets[name].headers)
+            # linked targets check if their dependencies are object libraries etc.
+            affected.update(self.dependents.get(name, []))
+        for h in headers:
+            affected.update(self.includers.get(h.removeprefix(repo_root), []))
+
+        return affected | cml_affected
+
+    def update(
+        self,
+        targets: dict[str, listeners.TargetNode],
+        commands: dict[str, list[listeners.TargetCommand]],
+        index: dependencies.DependencyIndex,
+        repo_root: str,
+        resolved: set[str] | None = None,
+    ):
+        """
+        Record the state after a run, `resolved` are the targets whose
+        includes were resolved in that run (all if `None`).
+        """
+        self.cml_targets = {f: command_targets(c) for f, c in commands.items()}
+        self.owners = {}
+        self.dependents = {}
+        files = set(commands)
+
+        if resolved is None:
+            self.includers = {}
+        else:
+            for h, names in self.includers.items():
+                self.includers[h] = [n for n in names if n not in resolved]
+
+        for name, target in targets.items():
+            if target.cml_path is None:
+                continue
+
+            for f in [*target.sources, *target.headers]:
+                self.owners.setdefault(f, []).append(name)
+                files.add(f)
+
+            for linked in [
+                *target.ppublic_targets,
+                *target.pprivate_targets,
+                *target.interface_targets,
+            ]:
+                self.dependents.setdefault(linked.name, []).append(name)
+
+            if resolved is not None and name not in resolved:
+                continue
+
+            reached = set()
+            stack = [*target.cpp_includes, *target.h_includes]
+            while stack:
+                h = stack.pop()
+                if h in reached:
+                    continue
+                reached.add(h)
+                stack.extend(index.includes.get(h, []))
+
+            for h in reached:
+                self.includers.setdefault(h, []).append(name)
+
+        files.update(os.path.join(repo_root, h) for h in index.includes)
+        # headers only used by targets that were not resolved were not read
+        # in this run, their fingerprints of the run that read them stay
+        previous = self.files
+        self.files = {f: fingerprint(f) for f in sorted(files)}
+        for h, names in self.includers.items():
+            f = os.path.join(repo_root, h)
+            if names and f not in self.files and f in previous:
+                self.files[f] = previous[f]
+
+
+def command_targets(commands: list[listeners.TargetCommand]) -> list[str]:
+    return list(dict.fromkeys(c.args[0] for c in commands if c.args))
@@ -1,13 +1,31 @@
+import difflib
 import os
 import re
-from glob import glob
+import shutil
+import sys
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from io import StringIO
+from typing import Callable, Iterable, Optional, TextIO
 
 import antlr4 as ant
-
-from . import listeners
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.error.ErrorListener import ConsoleErrorListener
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
+
+from . import dependencies, listeners, profiling
+from .cache import open_cache
+from .discovery import iter_files
+from .includes import CompileCommands, IncludeScanner, get_includes
+from .incremental import RunState, git_changed_files
 from .parser.CMakeLexer import CMakeLexer
 from .parser.CMakeParser import CMakeParser
 from .parser.CMakeParserListener import CMakeParserListener as CMakeListener
+from .resolver import Resolver, default_resolver
 
 
 def get_token_stream(file_path: str) -> ant.CommonTokenStream:
@@ -16,28 +34,344 @@ def get_token_stream(file_path: str) -> ant.CommonTokenStream:
     return ant.CommonTokenStream(lexer)
 
 
+def get_text_stream(virtual_path: str, text: str) -> ant.CommonTokenStream:
+    """
+    Same as `get_token_stream` for a file that is only in memory,
+    `virtual_path` takes the place of the file path.
+    """
+    input_stream = ant.InputStream(text)
+    input_stream.name = virtual_path
+    lexer = CMakeLexer(input_stream)
+    return ant.CommonTokenStream(lexer)
+
+
 def write_token_stream(file_path: str, stream: ant.CommonTokenStream) -> None:
-    # TODO find better way to get entire text
-    text = stream.getText(0, 999999999)
     with open(file_path, "w") as file:
-        file.write(text)
+        file.write(stream_text(stream))
+
+
+# reused for all files of a process, see `parse_stream`
+parser: CMakeParser | None = None
+
+
+def parse_stream(
+    stream: ant.CommonTokenStream, keep_going: bool = False
+) -> CMakeParser.Cmake_fileContext:
+    """
+    Parse `stream` with the faster SLL prediction first and only fall back to
+    full LL if that fails. SLL bails out on the first error and the input is
+    parsed again, so a syntax error is still reported by the LL pass. As the
+    grammar is not ambiguous both modes produce the same tree.
+
+    The first syntax error raises a `CancellationException`, with
+    `keep_going` the whole file is parsed and `ParseFailed` is raised with
+    all of its errors.
+    """
+    global parser
+    if parser is None:
+        parser = CMakeParser(stream)
+    else:
+        parser.setTokenStream(stream)
+
+    # errors of the SLL pass are not reported, the LL pass decides
+    parser.removeErrorListeners()
+    parser._errHandler = BailErrorStrategy()
+    parser._interp.predictionMode = PredictionMode.SLL
+    try:
+        return parser.cmake_file()
+    except ParseCancellationException:
+        stream.seek(0)
+        parser.reset()
+        parser._errHandler = DefaultErrorStrategy()
+        parser._interp.predictionMode = PredictionMode.LL
+        if not keep_going:
+            parser.addErrorListener(ConsoleErrorListener.INSTANCE)
+            parser.addErrorListener(listeners.SyntaxErrorListener())
+            return parser.cmake_file()
+
+        collector = listeners.SyntaxErrorCollector()
+        parser.addErrorListener(collector)
+        tree = parser.cmake_file()
+        if collector.errors:
+            raise listeners.ParseFailed(collector.errors)
+        return tree
+
+
+def walk_stream(
+    stream: ant.CommonTokenStream, listener: CMakeListener, keep_going: bool = False
+):
+    tree = parse_stream(stream, keep_going)
+    ant.ParseTreeWalker.DEFAULT.walk(listener, tree)
+    return listener
 
 
-def walk_stream(stream: ant.CommonTokenStream, listener: CMakeListener):
-    parser = CMakeParser(stream)
-    parser.addErrorListener(listeners.SyntaxErrorListener())
-    tree = parser.cmake_file()
-    walker = ant.ParseTreeWalker()
-    walker.walk(listener, tree)
-    return listener
+def parse_commands(
+    stream: ant.CommonTokenStream, keep_going: bool = False
+) -> list[listeners.TargetCommand]:
+    return walk_stream(stream, listeners.CommandListener(), keep_going).commands
+
+
+# The tokens `Add_command` and `Target_command` of CMakeLexer.g4. Tokens are
+# matched greedily so a command can not follow or be followed by a word
+# character. Matches in comments or arguments only cost an unnecessary parse.
+target_command_ptrn = re.compile(
+    rb"(?<!\w)(?:add_library|add_executable|target_\w+)(?!\w)", flags=re.IGNORECASE
+)
+
+
+def may_have_targets(file_path: str) -> bool:
+    """
+    Fast check if `file_path` can contain target commands, files without
+    any can not affect the target graph and do not have to be parsed.
+    """
+    with open(file_path, "rb") as file:
+        return target_command_ptrn.search(file.read()) is not None
+
+
+text_command_ptrn = re.compile(
+    target_command_ptrn.pattern.decode(), flags=re.IGNORECASE | re.ASCII
+)
+
+
+class ParseCache:
+    """
+    Keeps the result of parsing each file during the analysis pass so the
+    rewrite pass does not have to parse it again.
+
+    The recorded target commands are small and always kept. The token streams
+    needed to rewrite a file are only kept as long as their estimated size
+    stays below `max_mb`, files beyond that are lexed again when they are
+    rewritten.
+    """
+
+    # rough size of a token object incl. its text
+    token_size = 1024
+
+    def __init__(
+        self, max_mb: int = 512, profiler: profiling.Profiler | None = None
+    ) -> None:
+        self.profiler = profiling.Profiler() if profiler is None else profiler
+        self.max_bytes = max_mb * 1024 * 1024
+        self.size = 0
+        self.commands: dict[str, list[listeners.TargetCommand]] = {}
+        self.streams: dict[str, ant.CommonTokenStream] = {}
+
+    def add(
+        self,
+        file: str,
+        commands: list[listeners.TargetCommand],
+        stream: ant.CommonTokenStream | None = None,
+    ):
+        self.commands[file] = commands
+        if stream is None:
+            return
+
+        size = len(stream.tokens) * self.token_size
+        if self.size + size <= self.max_bytes:
+            self.streams[file] = stream
+            self.size += size
+
+    def parse(
+        self, file: str, keep_going: bool = False
+    ) -> list[listeners.TargetCommand]:
+        stream = get_token_stream(file)
+        with self.profiler.phase("lex", file):
+            stream.fill()
+        with self.profiler.phase("parse", file):
+            listener = walk_stream(stream, listeners.CommandListener(), keep_going)
+
+        self.profiler.count("tokens lexed", len(stream.tokens))
+        self.profiler.count("parse tree nodes", listener.nodes)
+        self.add(file, listener.commands, stream)
+        return listener.commands
+
+    def get(
+        self, file: str
+    ) -> tuple[ant.CommonTokenStream, list[listeners.TargetCommand]]:
+        """
+        Returns the token stream and commands of `file`, the stream is
+        removed from the cache as it is only needed once.
+        """
+        commands = self.commands[file]
+        stream = self.streams.pop(file, None)
+        if stream is None:
+            stream = get_token_stream(file)
+            with self.profiler.phase("lex", file):
+                stream.fill()
+            self.profiler.count("tokens lexed", len(stream.tokens))
+        else:
+            self.size -= len(stream.tokens) * self.token_size
+
+        return stream, commands
+
+
+# files sent to a worker at once, the number of files isn't known up front as
+# they are parsed while the tree is walked
+parse_chunk = 8
+
+
+def parse_file(file: str, keep_going: bool = False) -> list[listeners.TargetCommand]:
+    """
+    Parse `file` into its target commands. The commands are picklable so
+    this can run in a worker process.
+    """
+    return parse_commands(get_token_stream(file), keep_going)
+
+
+def try_parse(
+    parse, file: str
+) -> list[listeners.TargetCommand] | listeners.ParseFailed:
+    """
+    Calls `parse` with `keep_going` and returns the errors instead of raising
+    them, so a broken file does not end a `map` over all files.
+    """
+    try:
+        return parse(file, keep_going=True)
+    except listeners.ParseFailed as e:
+        return e
+
+
+def rewrite_file(file: str, edits: list[listeners.TokenEdit]) -> str | None:
+    """
+    Returns the text of `file` with `edits` applied or `None` if that is the
+    current text, the counterpart to `parse_file` for the rewrite pass.
+    """
+    stream = get_token_stream(file)
+    stream.fill()
+    text = apply_edits(stream, edits)
+    return None if text == stream_text(stream) else text
 
 
-def find_files(file_name: str, root_dir, excluded_dirs: list[str] = []):
-    file_paths = []
-    for root, dirs, files in os.walk(root_dir):
-        dirs[:] = [d for d in dirs if d not in excluded_dirs]
-        file_paths.extend([os.path.join(root, f) for f in files if file_name in f])
-    return file_paths
+def stream_text(stream: ant.CommonTokenStream) -> str:
+    return stream.tokenSource.inputStream.strdata
+
+
+def apply_edits(stream: ant.CommonTokenStream, edits: list[listeners.TokenEdit]) -> str:
+    """
+    Returns the text of the filled `stream` with `edits` applied, the stream
+    itself is not modified so it can be reused.
+    """
+    if not edits:
+        return stream_text(stream)
+    out = StringIO()
+    write_edits(stream, edits, out)
+    return out.getvalue()
+
+
+def write_edits(
+    stream: ant.CommonTokenStream, edits: list[listeners.TokenEdit], out: TextIO
+):
+    """
+    Write the text of the filled `stream` with `edits` applied to `out`.
+
+    Instead of joining the text of every token like `TokenStreamRewriter`
+    only the edited tokens are looked at, the text between edits is copied
+    from the input in one slice. Edits that overlap are left to the
+    rewriter as they interact in ways this does not handle.
+    """
+    text = stream_text(stream)
+    tokens = stream.tokens
+    # an insert after a token goes before a replace starting at the next one
+    spans = sorted(
+        (
+            (tokens[e.start].stop + 1, 0, tokens[e.start].stop + 1, e.text)
+            if e.kind == "insert_after"
+            else (tokens[e.start].start, 1, tokens[e.stop].stop + 1, e.text)
+        )
+        for e in edits
+    )
+
+    pos = 0
+    last_insert = -1
+    for start, is_replace, stop, _ in spans:
+        if start < pos or (not is_replace and start == last_insert):
+            rewriter = ant.TokenStreamRewriter.TokenStreamRewriter(stream)
+            for edit in edits:
+                edit.apply(rewriter)
+            out.write(rewriter.getText("default", 0, len(tokens) - 1))
+            return
+        pos = stop
+        if not is_replace:
+            last_insert = start
+
+    pos = 0
+    for start, _, stop, new in spans:
+        out.write(text[pos:start])
+        out.write(new)
+        pos = stop
+    out.write(text[pos:])
+
+
+def write_file(path: str, text: str):
+    """
+    Replace the contents of `path` through a temporary file in the same
+    directory, so it is never left half written.
+    """
+    fd, tmp = tempfile.mkstemp(prefix=".cmr-", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(text)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class FileWriter:
+    """
+    Writes files with `write_file` in `threads` background threads. At most
+    `max_pending` texts wait to be written, `write` blocks beyond that.
+    """
+
+    def __init__(self, threads: int = 4, max_pending: int = 64) -> None:
+        self.pool = ThreadPoolExecutor(threads)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.futures: list[Future] = []
+
+    def write(self, path: str, text: str):
+        self.pending.acquire()
+        future = self.pool.submit(write_file, path, text)
+        future.add_done_callback(lambda _: self.pending.release())
+        self.futures.append(future)
+
+    def close(self):
+        """
+        Wait for all writes, raises the first error.
+        """
+        self.pool.shutdown()
+        for future in self.futures:
+            future.result()
+
+
+def unified_diff(path: str, old: str, new: str, repo_root: str = "") -> str:
+    """
+    Unified diff of a file in the format of `git diff`, so it can be applied
+    with `git apply` from `repo_root`.
+    """
+    name = os.path.relpath(path, repo_root or None).replace(os.path.sep, "/")
+    lines = difflib.unified_diff(
+        old.splitlines(keepends=True),
+        new.splitlines(keepends=True),
+        f"a/{name}",
+        f"b/{name}",
+    )
+    diff = [f"diff --git a/{name} b/{name}\n"]
+    for line in lines:
+        diff.append(line)
+        if not line.endswith("\n"):
+            diff.append("\n\\ No newline at end of file\n")
+    return "".join(diff)
+
+
+def find_files(
+    file_name: str, root_dir, excluded_dirs: list[str] = [], ignore_files: bool = False
+):
+    """
+    All files named `file_name` below `root_dir`, see `discovery.iter_files`.
+    """
+    return list(iter_files(file_name, root_dir, excluded_dirs, ignore_files))
 
 
 def parse_targets(
@@ -54,25 +388,46 @@ def parse_targets(
     return targets
 
 
-def get_includes(file_path: str) -> tuple[list[str], list[str]]:
-    include_ptrn = re.compile(
-        '^#include\\s+["<]([\\w/]+\\.h.*)[">]', flags=re.IGNORECASE | re.MULTILINE
-    )
-    with open(file_path, "r") as file:
-        src = file.read()
-        includes: list[str] = re.findall(include_ptrn, src)
-
-    return (
-        [h for h in includes if h.startswith("velox")],
-        [h for h in includes if not h.startswith("velox")],
-    )
+def parse_texts(
+    files: Iterable[tuple[str, str]],
+    targets: dict[str, listeners.TargetNode] | None = None,
+    header_target_map=None,
+    repo_root="",
+    list_headers: Callable[[str], Iterable[str]] | None = None,
+) -> dict[str, listeners.TargetNode]:
+    """
+    Build the target graph from CMakeLists.txt that are only in memory, e.g.
+    read from git blobs or archives. `files` are `(virtual_path, text)` pairs
+    and can be a lazy iterator, every text is released after it was parsed.
+    Paths in the graph are relative to the directory of `virtual_path` as
+    for files on disk.
+
+    Nothing is read from disk: headers are only added to a target if listed
+    in its commands, unless `list_headers` returns the headers of a
+    directory (see `TargetInputListener`).
+    """
+    if targets is None:
+        targets = {}
+    for virtual_path, text in files:
+        if text_command_ptrn.search(text) is None:
+            continue
+        commands = parse_commands(get_text_stream(virtual_path, text))
+        listener = listeners.TargetInputListener(
+            targets, header_target_map, repo_root, list_headers
+        )
+        listener.replay(commands, virtual_path)
+    return targets
 
 
 def map_local_headers(
     targets: dict[str, listeners.TargetNode],
     header_target_map: dict[str, list[listeners.TargetNode]],
     repo_root: str,
+    scanner: IncludeScanner | None = None,
+    only: set[str] | None = None,
+    resolver: Resolver | None = None,
 ):
+    # Only the includes of the targets in `only` are resolved if it is set.
     # header:[dependency targets]
     # todo seperste map for header cpp matching?
     # e.g. for a header with no cpp file
@@ -81,27 +436,42 @@ def map_local_headers(
     # Header with no dependencies e.g. common/base/IOUtils.h:[]
     # We only care for headers used in cpp files/headers including these
     # as due to the global include dirs there are no header only targets.
+    if scanner is None:
+        scanner = IncludeScanner()
+    if resolver is None:
+        resolver = Resolver.load()
+
+    index = header_target_map
+    if not isinstance(index, dependencies.DependencyIndex):
+        index = dependencies.DependencyIndex(header_target_map)
+    # external targets that are not part of `targets`
+    external: dict[str, listeners.TargetNode] = {}
+
     def resolve_includes(files: list[str], target_list: list[listeners.TargetNode]):
         cpp_incs = []
         for file in files:
-            velox_h, deps_h = get_includes(file)
+            velox_h, deps_h = scanner.get_includes(file)
             cwd = os.path.dirname(file)
-            local_h = glob("*.h*", root_dir=cwd)
+            local_h = scanner.local_headers(cwd)
             # handle local headers used without full include path
             no_path_h = [h for h in deps_h if h in local_h]
             deps_h = [h for h in deps_h if h not in no_path_h]
             no_path_h = [
                 os.path.join(cwd.removeprefix(repo_root), h) for h in no_path_h
             ]
-            velox_h.extend(no_path_h)
+            velox_h = velox_h + no_path_h
             # don't parse ddb headers to avoid issues with vendored deps and
             # C stdlib headers
             if target.name not in ["duckdb", "tpch_extension", "dbgen"]:
-                dependencies = [d for h in deps_h if (d := get_dep_name(h))]
+                dependencies = [d for h in deps_h if (d := resolver.resolve(h))]
                 if 'gtest' in dependencies:
                     dependencies.append('gtest_main')
                 for dep in dependencies:
-                    dep_target = targets.get(dep, listeners.TargetNode(dep))
+                    dep_target = targets.get(dep)
+                    if dep_target is None:
+                        dep_target = external.setdefault(
+                            dep, listeners.TargetNode(dep)
+                        )
 
                     # We can directly add these dependencies as targets as
                     # we already know which header belongs to which target.
@@ -114,11 +484,16 @@ def map_local_headers(
             cpp_incs.extend([h for h in velox_h if h not in target_h])
         return cpp_incs
 
-    for _, target in targets.items():
-        if target.cml_path is None:
-            continue
+    resolved = [
+        t
+        for t in targets.values()
+        if t.cml_path is not None and (only is None or t.name in only)
+    ]
 
-        target_h = [h.removeprefix(repo_root) for h in target.headers]
+    # reading the files is the slow part, so it's done up front in parallel
+    scanner.prefetch(f for t in resolved for f in [*t.sources, *t.headers])
+    for target in resolved:
+        target_h = {h.removeprefix(repo_root) for h in target.headers}
 
         target.cpp_includes = [
             *set(resolve_includes(target.sources, target.private_targets))
@@ -129,141 +504,129 @@ def map_local_headers(
 
     # find header missing a target
     no_target_h: list[str] = []
-    for _, target in targets.items():
-        if target.cml_path is None:
-            continue
-        no_target_h.extend(
-            [h for h in target.cpp_includes if header_target_map.get(h) is None]
-        )
-        no_target_h.extend(
-            [h for h in target.h_includes if header_target_map.get(h) is None]
-        )
+    for target in resolved:
+        no_target_h.extend([h for h in target.cpp_includes if h not in index])
+        no_target_h.extend([h for h in target.h_includes if h not in index])
+
+    target_h = set()
 
-    no_target_h = [*set(no_target_h)]
-    target_h = []
-    for h in no_target_h:
+    def header_path(h: str) -> str | None:
+        path = os.path.join(repo_root, h)
         if any(element in h for element in ["duckdb", "tpch_extension", "dbgen"]):
-            continue
+            return None
+        if not os.path.isfile(path):
+            return None
+        return path
+
+    def scan_header(h: str):
+        path = header_path(h)
+        if path is None:
+            return [], []
 
         target_list: list[listeners.TargetNode] = []
-        incs = [*set(resolve_includes([os.path.join(repo_root, h)], target_list))]
-        extend_with_lookup(target_list, header_target_map, incs)
+        incs = [*set(resolve_includes([path], target_list))]
+        return target_list, incs
 
-        if target_list:
-            header_target_map[h] = target_list
+    no_target_h = [*dict.fromkeys(no_target_h)]
+    scanner.prefetch(p for h in no_target_h if (p := header_path(h)))
+    index.resolve(no_target_h, scan_header)
 
     # have to do second pass to avoid mixups
-    for _, target in targets.items():
-        if target.cml_path is None:
+    for target in resolved:
+        extend_with_lookup(target.private_targets, index, target.cpp_includes)
+        extend_with_lookup(target.public_targets, index, target.h_includes)
+
+    if index is not header_target_map:
+        for h, targets_h in index.items():
+            header_target_map[h] = list(targets_h)
+
+    return header_target_map
+
+
+def include_scanner(
+    file_cache=None,
+    include_preamble: bool = False,
+    compile_commands: Optional[str] = None,
+    **kwargs,
+) -> IncludeScanner:
+    """
+    An `IncludeScanner` with the options of the commands, `kwargs` are
+    passed on as they are.
+    """
+    compile_db = None
+    if compile_commands is not None:
+        compile_db = CompileCommands(compile_commands)
+    return IncludeScanner(file_cache, include_preamble, compile_db, **kwargs)
+
+
+def read_commands(
+    files: Iterable[str], file_cache=None, log: Callable = print
+) -> dict[str, list[listeners.TargetCommand]]:
+    """
+    The target commands of `files`, from `file_cache` if it has them and
+    parsed otherwise. Files that can't have any are left out.
+    """
+    file_commands = {}
+    for f in files:
+        commands = None
+        if file_cache is not None:
+            commands = file_cache.get("commands", f)
+        if commands is not None:
+            commands = [listeners.TargetCommand(*c) for c in commands]
+        elif not may_have_targets(f):
             continue
+        else:
+            log(f"Parsing: {f}")
+            commands = parse_file(f)
+            if file_cache is not None:
+                file_cache.put("commands", f, commands)
+        file_commands[f] = commands
+    return file_commands
 
-        extend_with_lookup(
-            target.private_targets, header_target_map, target.cpp_includes
-        )
 
-        extend_with_lookup(target.public_targets, header_target_map, target.h_includes)
+def build_graph(
+    file_commands: dict[str, list[listeners.TargetCommand]],
+    repo_root: str,
+    scanner: IncludeScanner | None = None,
+    deps_config: Optional[str] = None,
+    log: Callable = print,
+) -> tuple[dict[str, listeners.TargetNode], dict[str, list[listeners.TargetNode]]]:
+    """
+    The targets declared by `file_commands` with their includes resolved and
+    the header target map, ready for `UpdateTargetsListener`. Dependencies
+    that `deps_config` doesn't know are logged.
+    """
+    targets: dict[str, listeners.TargetNode] = {}
+    hm: dict[str, list[listeners.TargetNode]] = {}
+    for f, commands in file_commands.items():
+        listener = listeners.TargetInputListener(
+            targets, header_target_map=hm, repo_root=repo_root
+        )
+        listener.replay(commands, f)
 
-    return header_target_map
+    resolver = Resolver.load(deps_config)
+    map_local_headers(targets, hm, repo_root, scanner, resolver=resolver)
+    if resolver.unknown:
+        log(f"Unknown dependencies: {resolver.summary()}")
+    for t in targets.values():
+        t.was_linked = False
+    return targets, hm
 
 
 def extend_with_lookup(extendee: list, dict: dict, keys: list[str]):
     for k in keys:
         if k in dict:
-            extendee.extend(dict[k])
+            extendee.extend([t for t in dict[k] if t not in extendee])
 
 
 def get_dep_name(header: str) -> str:
-    name = os.path.splitext(header.lower())[0].split("/")
-    header_libs = [
-        "altivec",
-        "arm_neon",
-        "assert",
-        "date",
-        "dlfcn",
-        "fcntl",
-        "glob",
-        "limits",
-        "linux",
-        "pthread",
-        "pwd",
-        "spe",
-        "string",
-        "sys",
-        "time",
-        "xxhash",
-    ]
-    if (
-        name[0] in header_libs
-        or "intrin" in name[0]
-        or ("std" in name[0] and not name[0] == "zstd")
-    ):
-        name[0] = "header lib"
-    match name[0]:
-        case "arrow":
-            target = "arrow"
-        case "aws":
-            # todo find a better way...
-            target = "${AWSSDK_LIBRARIES}"
-        case "hdfs":
-            target = "${LIBHDFS3}"
-        case "boost":
-            boost_header = [
-                "algorithm",
-                "crc",
-                "circular_buffer",
-                "lexical_cast",
-                "math",
-                "multi_index",
-                "numeric",
-                "process",
-                "random",
-                "uuid",
-                "variant",
-            ]
-            if name[1] in boost_header:
-                target = "Boost::headers"
-            else:
-                target = f"Boost::{name[1]}"
-        case "folly":
-            target = "Folly::folly"
-        case "fmt":
-            target = "fmt::fmt"
-        case "google":
-            target = "google-cloud-cpp::storage"
-        case "gflags":
-            target = "gflags::gflags"
-        case "gtest":
-            # gtest or gtest_main? or rather Gtest::main?
-            target = "gtest"
-        case "gmock":
-            target = "gmock"
-        case "glog":
-            target = "glog::glog"
-        case "lz4":
-            target = "lz4::lz4"
-        case "parquet":
-            target = "parquet"
-        case "re2":
-            target = "re2::re2"
-        case "simdjson":
-            target = "simdjson"
-        case "snappy":
-            target = "Snappy::snappy"
-        case "thrift":
-            target = "thrift::thrift"
-        case "xsimd":
-            target = "xsimd"
-        case "zstd":
-            target = "zstd::zstd"
-        case "zlib":
-            target = "ZLIB::ZLIB"
-        case "header lib":
-            target = ""
-        case _:
-            raise Exception(
-                f"Found unmatched dependency {name[0]} with header {header}"
-            )
-
+    """
+    The target providing the external `header` according to the packaged
+    config, see `Resolver`.
+    """
+    target = default_resolver().resolve(header)
+    if target is None:
+        raise Exception(f"Found unmatched dependency with header {header}")
     return target
 
 
@@ -281,30 +644,331 @@ def has_matching_src(header: str, sources: list[str], repo_root="") -> bool:
 
 
 def update_links(
-    src_dir: str, repo_root: str, excluded_dirs: list[str] = [], dry_run: bool = True
+    src_dir: str,
+    repo_root: str,
+    excluded_dirs: list[str] = [],
+    dry_run: bool = True,
+    parse_cache_mb: int = 512,
+    jobs: int = 1,
+    cache: bool = True,
+    cache_dir: Optional[str] = None,
+    include_preamble: bool = False,
+    compile_commands: Optional[str] = None,
+    profile: Optional[str] = None,
+    cprofile: Optional[str] = None,
+    incremental: bool = False,
+    since: Optional[str] = None,
+    changed: list[str] = [],
+    keep_going: bool = False,
+    write_threads: int = 4,
+    scan_threads: int = 8,
+    diff: Optional[str] = None,
+    ignore_files: bool = False,
+    deps_config: Optional[str] = None,
+    graph: Optional[str] = None,
 ):
-    file = "CMakeLists.txt"
-    # the tariling slash is needed for the prefix removal
-    # note: need posix path TODO enforce
-    repo_root = os.path.abspath(repo_root) + "/"
-    files = find_files(file, os.path.join(repo_root, src_dir), excluded_dirs)
-    targets: dict[str, listeners.TargetNode] = {}
-    hm: dict[str, listeners.TargetNode] = {}
-    for f in files:
-        print(f"Parsing: {f}")
-        parse_targets(f, targets, header_target_map=hm, repo_root=repo_root)
-    print("Building Dependency Tree")
-    map_local_headers(targets, hm, repo_root)
+    """
+    `excluded_dirs` are gitignore style patterns relative to SRC_DIR, with
+    `ignore_files` the `.gitignore` and `.ignore` files are honoured too.
+
+    With `incremental` only the targets affected by files changed since the
+    last run that wrote its results are resolved again and only the
+    CMakeLists.txt with their commands are rewritten. Changed files are found
+    by their mtime, or given by `since` (a git revision) or `changed`, both
+    imply `incremental`. Needs the cache, without a previous run everything
+    is updated.
+
+    The cache is kept in `cache_dir`, by default in `.cmr_cache` in the repo
+    root which dry runs only use if it exists.
+
+    With `keep_going` all files are parsed instead of ending the run at the
+    first syntax error, all errors are reported at the end and the exit code
+    is 1. Nothing is updated then, the targets of a broken file are missing
+    from the graph so the links of any other target could be wrong.
+
+    `diff` is a file (`-` for stdout) the changes are written to as a patch
+    for `git apply`, with stdout the progress is printed to stderr.
+
+    Sources and headers are read in `scan_threads` threads before the
+    includes are resolved, 1 reads them one at a time during resolution.
+    With `include_preamble` only the top of a file up to the first line of
+    code is read, see `includes.read_includes`.
+
+    `deps_config` is a TOML file mapping external includes to their targets
+    (see `external_targets.toml`), includes it doesn't know are reported.
+
+    With `graph` the targets are read from a graph written by `cmr analyze`
+    instead of analyzing the tree, only the commands to rewrite are parsed.
+    It can't be combined with `incremental`.
+    """
+    if graph is not None and (incremental or since is not None or changed):
+        raise ValueError("`graph` can't be combined with `incremental`")
+
+    # closed on errors and cancellation too, the cache only commits on close
+    with ExitStack() as stack:
+        patch = None
+        log = print
+        if diff == "-":
+            patch = sys.stdout
+            log = partial(print, file=sys.stderr)
+        elif diff is not None:
+            patch = stack.enter_context(open(diff, "w", newline=""))
+
+        if cprofile is not None:
+            cprofiler = profiling.start_cprofile()
+        profiler = profiling.Profiler()
+
+        file = "CMakeLists.txt"
+        # the tariling slash is needed for the prefix removal
+        # note: need posix path TODO enforce
+        repo_root = os.path.abspath(repo_root) + "/"
+        targets: dict[str, listeners.TargetNode] = {}
+        if graph is not None:
+            # imported here as the graph module needs this one
+            from .graph import Graph
+
+            targets = Graph(graph)
+            if targets.repo_root != repo_root:
+                raise ValueError(f"`{graph}` was written for {targets.repo_root}")
+        hm = dependencies.DependencyIndex()
+        parsed = ParseCache(parse_cache_mb, profiler)
+        pool = None
+        if jobs > 1:
+            pool = ProcessPoolExecutor(jobs)
+            stack.callback(pool.shutdown, cancel_futures=True)
+        file_cache = None
+        if cache:
+            file_cache = open_cache(repo_root, cache_dir, create=not dry_run)
+        if file_cache is not None:
+            stack.callback(file_cache.close)
+
+        files: list[str] = []
+        cached_commands = {}
+
+        def discover():
+            # yields the files to parse while walking the tree, so the workers
+            # can start before the walk is done
+            for f in iter_files(
+                file, os.path.join(repo_root, src_dir), excluded_dirs, ignore_files
+            ):
+                files.append(f)
+                if file_cache is not None:
+                    with profiler.phase("cache"):
+                        commands = file_cache.get("commands", f)
+                    if commands is not None:
+                        commands = [listeners.TargetCommand(*c) for c in commands]
+                        cached_commands[f] = commands
+                        continue
+                with profiler.phase("prefilter"):
+                    has_targets = may_have_targets(f)
+                if has_targets:
+                    yield f
+                else:
+                    cached_commands[f] = []
+                    profiler.count("files skipped")
+
+        parse = parsed.parse if pool is None else parse_file
+        if keep_going:
+            parse = partial(try_parse, parse)
+        with profiler.phase("discover"):
+            if pool is None:
+                file_commands = map(parse, list(discover()))
+            else:
+                # workers return the commands in file order, replaying them in
+                # that order gives the exact same graph as a serial run
+                file_commands = pool.map(parse, discover(), chunksize=parse_chunk)
+
+        errors: list[listeners.ParseError] = []
+        for f in files:
+            commands = cached_commands.get(f)
+            if commands is None:
+                log(f"Parsing: {f}")
+                if pool is None:
+                    commands = next(file_commands)
+                else:
+                    with profiler.phase("parse"):
+                        commands = next(file_commands)
+                profiler.count("files parsed")
+                if isinstance(commands, listeners.ParseFailed):
+                    # the file is left out of the graph, nothing is rewritten
+                    errors.extend(commands.errors)
+                    profiler.count("files with errors")
+                    commands = []
+                elif file_cache is not None:
+                    file_cache.put("commands", f, commands)
+
+            parsed.add(f, commands)
+            if graph is not None:
+                continue
+            with profiler.phase("analyze", f):
+                listener = listeners.TargetInputListener(
+                    targets, header_target_map=hm, repo_root=repo_root
+                )
+                listener.replay(commands, f)
+
+        all_commands = dict(parsed.commands)
+        state = None
+        affected = None
+        if file_cache is not None:
+            state = file_cache.get_state("run")
+            state = None if state is None else RunState(state)
+        incremental = incremental or since is not None or bool(changed)
+        if incremental and state is not None:
+            with profiler.phase("changes"):
+                if changed or since is not None:
+                    changed_files = {os.path.abspath(f) for f in changed}
+                    if since is not None:
+                        changed_files.update(git_changed_files(repo_root, since))
+                else:
+                    changed_files = state.changed_files(files)
+                affected = state.affected_targets(
+                    changed_files, targets, parsed.commands, repo_root
+                )
+            log(
+                f"Incremental: {len(changed_files)} changed files, "
+                f"{len(affected)} affected targets"
+            )
+            # only the commands of affected targets are replayed, the other
+            # targets are left as they were written by the last run
+            for f, commands in parsed.commands.items():
+                parsed.commands[f] = [
+                    c
+                    for c in commands
+                    if c.kind != "modify_target" or c.args[0] in affected
+                ]
+        elif incremental:
+            log("Incremental: no previous run found, updating all targets")
+
+        # files without target_* commands stay the same
+        files = [
+            f
+            for f in files
+            if any(c.kind == "modify_target" for c in parsed.commands[f])
+        ]
 
-    for t in targets.values():
-        t.was_linked = False
+        if errors:
+            files = []
+            log("Skipping the update due to syntax errors")
+        elif graph is None:
+            log("Building Dependency Tree")
+            scanner = include_scanner(
+                file_cache,
+                include_preamble,
+                compile_commands,
+                profiler=profiler,
+                threads=scan_threads,
+            )
+            resolver = Resolver.load(deps_config)
+            with profiler.phase("dependencies"):
+                map_local_headers(targets, hm, repo_root, scanner, affected, resolver)
+            profiler.count("files scanned", scanner.files_read)
+            log(scanner.summary())
+            for cycle in hm.cycles:
+                log(f"Include cycle: {' -> '.join(cycle)}")
+            if resolver.unknown:
+                # these are not linked, add them to the config to fix that
+                profiler.count("unknown dependencies", len(resolver.unknown))
+                log(f"Unknown dependencies: {resolver.summary()}")
+        else:
+            log(f"Using the targets of {graph}")
+
+        for t in targets.values():
+            t.was_linked = False
+
+        def update_file(f: str) -> str | None:
+            token_stream, commands = parsed.get(f)
+            with profiler.phase("rewrite", f):
+                update_listener = listeners.UpdateTargetsListener(targets)
+                update_listener.replay(commands)
+                text = apply_edits(token_stream, update_listener.edits)
+            count_rewrites(update_listener.edits)
+            return None if text == stream_text(token_stream) else text
+
+        def count_rewrites(edits: list[listeners.TokenEdit]):
+            profiler.count(
+                "targets rewritten", [e.kind for e in edits].count("replace")
+            )
 
-    for f in files:
-        print(f"Parsing: {f}")
-        token_stream = get_token_stream(f)
-        update_listener = listeners.UpdateTargetsListener(targets, token_stream)
-        walk_stream(token_stream, update_listener)
-        updated_cml = update_listener.token_stream.getText("default", 0, 999999999)
+        if pool is None:
+            updated_cmls = map(update_file, files)
+        else:
+            # which call of target_link_libraries gets replaced depends on the
+            # order of files so the edits are planned here and only applied in
+            # the workers
+            file_edits = []
+            with profiler.phase("rewrite"):
+                for f in files:
+                    update_listener = listeners.UpdateTargetsListener(targets)
+                    update_listener.replay(parsed.commands[f])
+                    file_edits.append(update_listener.edits)
+                    count_rewrites(update_listener.edits)
+            chunksize = max(1, len(files) // (jobs * 4))
+            updated_cmls = pool.map(
+                rewrite_file, files, file_edits, chunksize=chunksize
+            )
+
+        writer = None
         if not dry_run:
-            with open(f, "w") as new_f:
-                new_f.write(updated_cml)
+            writer = FileWriter(write_threads)
+            # the writes in flight finish before an error is raised
+            stack.callback(writer.pool.shutdown)
+        for f in files:
+            if pool is None:
+                updated_cml = next(updated_cmls)
+            else:
+                with profiler.phase("rewrite"):
+                    updated_cml = next(updated_cmls)
+
+            # unchanged files are not touched to keep their mtime
+            if updated_cml is None:
+                profiler.count("files unchanged")
+                continue
+
+            log(f"Updating: {f}")
+            profiler.count("files changed")
+            if patch is not None:
+                # the rewritten text keeps the line endings of the file
+                with open(f, "r", newline="") as original:
+                    patch.write(
+                        unified_diff(f, original.read(), updated_cml, repo_root)
+                    )
+                patch.flush()
+            if writer is not None:
+                writer.write(f, updated_cml)
+
+        if writer is not None:
+            with profiler.phase("write"):
+                writer.close()
+
+        n_changed = profiler.counters.get("files changed", 0)
+        n_unchanged = profiler.counters.get("files unchanged", 0)
+        if dry_run:
+            log(f"{n_changed} files would be updated, {n_unchanged} unchanged")
+        else:
+            log(f"Updated {n_changed} files, {n_unchanged} unchanged")
+
+        if file_cache is not None:
+            # a graph doesn't have the includes of the headers the state needs
+            if not dry_run and graph is None and not errors:
+                # fingerprints are taken after writing so the rewritten files do
+                # not count as changed in the next run
+                with profiler.phase("changes"):
+                    if state is None:
+                        state = RunState()
+                    state.update(targets, all_commands, hm, repo_root, affected)
+                    file_cache.put_state("run", state.to_json())
+            log(f"Cache: {file_cache.hits} hits, {file_cache.misses} misses")
+
+        profiler.finish()
+        log(profiler.summary())
+        if profile is not None:
+            profiler.write(profile)
+        if cprofile is not None:
+            profiling.stop_cprofile(cprofiler, cprofile)
+
+        if errors:
+            n_files = len({e.file for e in errors})
+            log(f"{len(errors)} syntax errors in {n_files} files, nothing was updated:")
+            for error in errors:
+                log(error)
+            raise SystemExit(1)
@@ -1,8 +1,10 @@
 import os
 import re
+import sys
 from glob import glob
+from typing import Callable, Iterable, NamedTuple
 
-from antlr4 import CommonTokenStream, ParserRuleContext
+from antlr4 import CommonTokenStream, InputStream, ParserRuleContext
 from antlr4.error.ErrorListener import ErrorListener
 from antlr4.error.Errors import CancellationException
 from antlr4.TokenStreamRewriter import TokenStreamRewriter
@@ -19,7 +21,225 @@ def list_if_none(arg: list | None) -> list:
         return arg
 
 
+def context_args(ctx: ParserRuleContext) -> list[str]:
+    """
+    Arguments in CMake can be quoted using '"' but this makes no difference
+    for the parsing in this package so we strip the quotes.
+    """
+    args = [arg.getText() for arg in ctx.arguments().single_argument()]
+    return [arg.replace('"', "") for arg in args]
+
+
+def input_name(stream: InputStream) -> str:
+    """
+    Path of the file `stream` was read from, or the virtual path of an
+    in-memory stream (see `io.get_text_stream`).
+    """
+    return getattr(stream, "fileName", stream.name)
+
+
+def glob_headers(dir: str) -> list[str]:
+    return glob(dir + "/*.h*")
+
+
+class TargetCommand(NamedTuple):
+    """
+    A target command (`add_*` or `target_*`) as found in a parse tree.
+
+    This holds everything the listeners in this module need from the tree,
+    so a file only has to be parsed once and the commands can be replayed
+    for any later pass. `start` and `stop` are the token indices of the
+    command in the token stream of the file, `line` is the line it starts on.
+    """
+
+    kind: str
+    command: str
+    args: list[str]
+    compound_args: int
+    start: int
+    stop: int
+    line: int
+
+    @classmethod
+    def from_context(cls, ctx: ParserRuleContext) -> "TargetCommand":
+        if isinstance(ctx, CMakeParser.Add_targetContext):
+            kind = "add_target"
+        else:
+            kind = "modify_target"
+
+        return cls(
+            kind,
+            ctx.command.text.lower(),
+            context_args(ctx),
+            len(ctx.arguments().compound_argument()),
+            ctx.start.tokenIndex,
+            ctx.stop.tokenIndex,
+            ctx.start.line,
+        )
+
+
+class TokenEdit(NamedTuple):
+    """
+    A change to the token stream of a file, either replacing the tokens
+    `start` to `stop` or inserting after the token `start`.
+    """
+
+    kind: str
+    start: int
+    stop: int
+    text: str
+
+    def apply(self, rewriter: TokenStreamRewriter):
+        if self.kind == "replace":
+            rewriter.replaceRange(self.start, self.stop, self.text)
+        else:
+            rewriter.insertAfter(self.start, self.text)
+
+
+class OrderedSet:
+    """
+    Insertion ordered set that supports the list methods used on lists of
+    targets so it can be used in their place.
+    """
+
+    __slots__ = ("items",)
+
+    def __init__(self, items=()) -> None:
+        self.items: dict = {}
+        self.extend(items)
+
+    def append(self, item) -> None:
+        self.items[item] = None
+
+    def extend(self, items) -> None:
+        for item in items:
+            self.append(item)
+
+    def remove(self, item) -> None:
+        del self.items[item]
+
+    def __contains__(self, item) -> bool:
+        return item in self.items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, index):
+        if index == 0 and self.items:
+            return next(iter(self))
+        return list(self)[index]
+
+    def __add__(self, other) -> list:
+        return [*self, *other]
+
+    def __radd__(self, other) -> list:
+        return [*other, *self]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Iterable):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({list(self)})"
+
+
+class PathTable:
+    """
+    Interned paths, each path is stored once and referenced by its index.
+    """
+
+    def __init__(self) -> None:
+        self.paths: list[str] = []
+        self.ids: dict[str, int] = {}
+
+    def id(self, path: str) -> int:
+        id = self.ids.get(path)
+        if id is None:
+            id = len(self.paths)
+            path = sys.intern(path)
+            self.paths.append(path)
+            self.ids[path] = id
+        return id
+
+
+# shared by all targets so a header used by many targets is only stored once
+paths = PathTable()
+
+
+class PathSet(OrderedSet):
+    """
+    `OrderedSet` of paths that only stores their ids in `paths`.
+    """
+
+    __slots__ = ()
+
+    def append(self, path: str) -> None:
+        self.items[paths.id(path)] = None
+
+    def remove(self, path: str) -> None:
+        del self.items[paths.ids[path]]
+
+    def __contains__(self, path) -> bool:
+        return paths.ids.get(path) in self.items
+
+    def __iter__(self):
+        return (paths.paths[id] for id in self.items)
+
+
+def ordered_set_property(name: str, kind=OrderedSet) -> property:
+    """
+    Property for a collection attribute stored in the slot `_<name>`,
+    assigning a list converts it.
+    """
+    slot = "_" + name
+
+    def setter(self, items) -> None:
+        setattr(self, slot, items if type(items) is kind else kind(items))
+
+    return property(lambda self: getattr(self, slot), setter)
+
+
 class TargetNode:
+    """
+    A target and its edges to other targets.
+
+    File lists are `PathSet`s and target lists `OrderedSet`s. Both behave like
+    the lists they replace (`append`, `extend`, `in`, indexing, `+`) but
+    have constant time membership tests and don't store duplicates.
+    """
+
+    __slots__ = (
+        "name",
+        "_headers",
+        "_cpp_includes",
+        "_h_includes",
+        "_sources",
+        "_public_targets",
+        "_private_targets",
+        "_ppublic_targets",
+        "_pprivate_targets",
+        "_interface_targets",
+        "is_interface",
+        "alias_for",
+        "_cml_path",
+        "is_object_lib",
+        "was_linked",
+    )
+
+    headers = ordered_set_property("headers", PathSet)
+    cpp_includes = ordered_set_property("cpp_includes", PathSet)
+    h_includes = ordered_set_property("h_includes", PathSet)
+    sources = ordered_set_property("sources", PathSet)
+    public_targets = ordered_set_property("public_targets")
+    private_targets = ordered_set_property("private_targets")
+    ppublic_targets = ordered_set_property("ppublic_targets")
+    pprivate_targets = ordered_set_property("pprivate_targets")
+    interface_targets = ordered_set_property("interface_targets")
+
     def __init__(
         self,
         name: str,
@@ -31,25 +251,33 @@ class TargetNode:
     ) -> None:
         if not name:
             raise Exception("Can not create target without name!")
-        self.name: str = name
-        self.headers: list[str] = list_if_none(headers)
-        self.cpp_includes: list[str] = []
-        self.h_includes: list[str] = []
-        self.sources: list[str] = list_if_none(sources)
+        self.name: str = sys.intern(name)
+        self.headers = list_if_none(headers)
+        self.cpp_includes = []
+        self.h_includes = []
+        self.sources = list_if_none(sources)
         # targets parsed from source files
-        self.public_targets: list[TargetNode] = []
-        self.private_targets: list[TargetNode] = []
+        self.public_targets = []
+        self.private_targets = []
         # targets parsed from cml
-        self.ppublic_targets: list[TargetNode] = []
-        self.pprivate_targets: list[TargetNode] = []
+        self.ppublic_targets = []
+        self.pprivate_targets = []
         # interface targets can not be detected via code
-        self.interface_targets: list[TargetNode] = []
+        self.interface_targets = []
         self.is_interface = is_interface
         self.alias_for: TargetNode | None = alias_for
         self.cml_path: str | None = cml_path
         self.is_object_lib = False
         self.was_linked = False
 
+    @property
+    def cml_path(self) -> str | None:
+        return self._cml_path
+
+    @cml_path.setter
+    def cml_path(self, path: str | None) -> None:
+        self._cml_path = None if path is None else sys.intern(path)
+
     def __str__(self) -> str:
         message: str = self.name + ":\n"
         if self.alias_for:
@@ -85,10 +313,49 @@ class TargetNode:
 class SyntaxErrorListener(ErrorListener):
     def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
         super().syntaxError(recognizer, offendingSymbol, line, column, msg, e)
-        file_name = recognizer.getInputStream().tokenSource._input.fileName
+        file_name = input_name(recognizer.getInputStream().tokenSource._input)
         raise CancellationException(f"{file_name} line {line}:{column} {msg}")
 
 
+class ParseError(NamedTuple):
+    file: str
+    line: int
+    column: int
+    msg: str
+
+    def __str__(self) -> str:
+        return f"{self.file} line {self.line}:{self.column} {self.msg}"
+
+
+class ParseFailed(Exception):
+    """
+    Raised after a file was parsed completely with all of its syntax errors,
+    instead of the `CancellationException` on the first one.
+    """
+
+    def __init__(self, errors: list[ParseError]) -> None:
+        super().__init__(errors)
+        self.errors = errors
+
+    def __str__(self) -> str:
+        return "\n".join(str(e) for e in self.errors)
+
+
+class SyntaxErrorCollector(ErrorListener):
+    """
+    Records syntax errors instead of raising, the parser recovers from them
+    so all errors of a file are found in one pass.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.errors: list[ParseError] = []
+
+    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
+        file_name = input_name(recognizer.getInputStream().tokenSource._input)
+        self.errors.append(ParseError(file_name, line, column, msg))
+
+
 class BaseListener(CMakeListener):
     def __init__(self, targets: dict[str, TargetNode]) -> None:
         super().__init__()
@@ -103,22 +370,73 @@ class BaseListener(CMakeListener):
         return node
 
     def get_args(self, ctx: ParserRuleContext):
-        """
-        Arguments in CMake can be quoted using '"' but this makes no difference
-        for the parsing in this package so we strip the quotes.
-        """
-        args = [arg.getText() for arg in ctx.arguments().single_argument()]
-        return [arg.replace('"', "") for arg in args]
+        return context_args(ctx)
+
+
+class CommandListener(CMakeListener):
+    """
+    Records all target commands of a file in order of appearance.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.commands: list[TargetCommand] = []
+        # number of parse tree nodes, for profiling
+        self.nodes = 0
+
+    def enterEveryRule(self, ctx: ParserRuleContext):
+        self.nodes += 1
+
+    def exitAdd_target(self, ctx: CMakeParser.Add_targetContext):
+        self.commands.append(TargetCommand.from_context(ctx))
+
+    def exitModify_target(self, ctx: CMakeParser.Modify_targetContext):
+        self.commands.append(TargetCommand.from_context(ctx))
 
 
 class TargetInputListener(BaseListener):
-    def __init__(self, targets, header_target_map=None, repo_root="") -> None:
+    """
+    Builds the target graph from the target commands. Headers in the
+    directory of a target with a matching source are added to the target,
+    `list_headers` returns the headers in a directory. It lists them on disk
+    by default, `None` only uses the headers listed in the commands.
+    """
+
+    def __init__(
+        self,
+        targets,
+        header_target_map=None,
+        repo_root="",
+        list_headers: Callable[[str], Iterable[str]] | None = glob_headers,
+    ) -> None:
         super().__init__(targets)
         self.in_if = False
         self.header_target_map = header_target_map
         self.repo_root = repo_root
+        self.list_headers = list_headers
+
+    def replay(self, commands: list[TargetCommand], file_path: str):
+        """
+        Apply previously recorded commands of the file at `file_path` as if
+        the parse tree of that file was walked.
+        """
+        for command in commands:
+            if command.kind == "add_target":
+                self.add_target(command, file_path)
+            else:
+                self.modify_target(command, file_path)
 
     def exitAdd_target(self, ctx: CMakeParser.Add_targetContext):
+        self.add_target(
+            TargetCommand.from_context(ctx), input_name(ctx.start.getInputStream())
+        )
+
+    def exitModify_target(self, ctx: CMakeParser.Modify_targetContext):
+        self.modify_target(
+            TargetCommand.from_context(ctx), input_name(ctx.start.getInputStream())
+        )
+
+    def add_target(self, command: TargetCommand, file_path: str):
         """
         This function is triggered by a cmake command that adds a target.
         For any one target this function can only be called once in a valid
@@ -132,16 +450,16 @@ class TargetInputListener(BaseListener):
         Files that end on .c* are source files (this ignores non c/++ files
         as we don't want to analyse them).
         """
-        cmd = ctx.command.text.lower()
-        args = self.get_args(ctx)
+        cmd = command.command
+        args = command.args
 
         if len(args) == 0:
             raise Exception(f"`{cmd}` called without arguments!")
 
-        if len(ctx.arguments().compound_argument()) > 0:
+        if command.compound_args > 0:
             raise Exception(f"Compound arguments not valid for `{cmd}`!")
 
-        cml_path = os.path.dirname(ctx.start.getInputStream().fileName)
+        cml_path = os.path.dirname(file_path)
         name = args[0]
         target = self.ensure_target(name)
         args = self.clean_target_args(args)
@@ -168,17 +486,16 @@ class TargetInputListener(BaseListener):
 
         target.cml_path = cml_path
 
-    def exitModify_target(self, ctx: CMakeParser.Modify_targetContext):
-        cmd = ctx.command.text.lower()
-
-        args = self.get_args(ctx)
+    def modify_target(self, command: TargetCommand, file_path: str):
+        cmd = command.command
+        args = command.args
 
         if cmd == "target_link_libraries":
             self.add_linked_targets(args)
 
         if cmd == "target_sources":
             args = self.clean_target_args(args)
-            cml_path = os.path.dirname(ctx.start.getInputStream().fileName)
+            cml_path = os.path.dirname(file_path)
             self.add_target_sources(args, cml_path)
 
     def add_linked_targets(self, args: list[str]):
@@ -202,9 +519,14 @@ class TargetInputListener(BaseListener):
         files = [f.replace("${CMAKE_CURRENT_LIST_DIR}/", cml_path) for f in files]
         files = [os.path.join(cml_path, f) for f in files if not os.path.dirname(f)]
         sources, headers = self.sort_files(files)
-        headers.extend(
-            [h for h in glob(cml_path + "/*.h*") if io.has_matching_src(h, sources)]
-        )
+        if self.list_headers is not None:
+            headers.extend(
+                [
+                    h
+                    for h in self.list_headers(cml_path)
+                    if io.has_matching_src(h, sources)
+                ]
+            )
         target.headers.extend(headers)
         target.sources.extend(sources)
 
@@ -284,12 +606,38 @@ class TargetInputListener(BaseListener):
 
 
 class UpdateTargetsListener(BaseListener):
-    def __init__(self, targets: dict[str, TargetNode], token_stream: CommonTokenStream):
+    """
+    Updates the `target_link_libraries` calls with the targets found in the
+    sources. All changes are collected in `edits` and, if a token stream
+    is passed, applied to the rewriter in `token_stream` as well.
+    """
+
+    def __init__(
+        self,
+        targets: dict[str, TargetNode],
+        token_stream: CommonTokenStream | None = None,
+    ):
         super().__init__(targets)
-        self.token_stream = TokenStreamRewriter(token_stream)
+        self.edits: list[TokenEdit] = []
+        self.token_stream = None
+        if token_stream is not None:
+            self.token_stream = TokenStreamRewriter(token_stream)
+
+    def edit(self, edit: TokenEdit):
+        self.edits.append(edit)
+        if self.token_stream is not None:
+            edit.apply(self.token_stream)
+
+    def replay(self, commands: list[TargetCommand]):
+        for command in commands:
+            if command.kind == "modify_target":
+                self.update_target(command)
 
     def exitModify_target(self, ctx: CMakeParser.Modify_targetContext):
-        args = self.get_args(ctx)
+        self.update_target(TargetCommand.from_context(ctx))
+
+    def update_target(self, command: TargetCommand):
+        args = command.args
         target = self.ensure_target(args[0])
 
         if not target.cml_path:
@@ -326,8 +674,8 @@ class UpdateTargetsListener(BaseListener):
             )
             public_targets = sort_targets([*set([t.name for t in public_targets])])
             private_targets = sort_targets([*set([t.name for t in private_targets])])
-            start = ctx.start.tokenIndex + 2
-            stop = ctx.stop.tokenIndex - 1
+            start = command.start + 2
+            stop = command.stop - 1
 
             if (
                 len(public_targets) + len(private_targets) == 0
@@ -352,7 +700,7 @@ class UpdateTargetsListener(BaseListener):
             new = f"{target.name}" + p_text + pr_text
             if target.is_interface:
                 new = f'{target.name} INTERFACE {" ".join(sort_targets(public_targets + private_targets))}'
-            self.token_stream.replaceRange(start, stop, new)
+            self.edit(TokenEdit("replace", start, stop, new))
             target.was_linked = True
         else:
             scopes = ["INTERFACE", "PUBLIC", "PRIVATE"]
@@ -360,7 +708,11 @@ class UpdateTargetsListener(BaseListener):
                 # if a target was linked with a keyword all other
                 # occurences of target_link_libraries must also use
                 # a keyword
-                self.token_stream.insertAfter(
-                    ctx.start.tokenIndex + 3,
-                    f'{"INTERFACE" if target.is_interface else "PUBLIC"} ',
+                self.edit(
+                    TokenEdit(
+                        "insert_after",
+                        command.start + 3,
+                        command.start + 3,
+                        f'{"INTERFACE" if target.is_interface else "PUBLIC"} ',
+                    )
                 )
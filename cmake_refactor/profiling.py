@@ -0,0 +1,82 @@
+import cProfile
+import json
+import time
+from contextlib import contextmanager
+
+
+class Profiler:
+    """
+    Records wall and CPU time of the phases of a run, in total and per file,
+    as well as counters like the number of tokens lexed.
+
+    Phases can be entered repeatedly, their times are summed up. The time
+    from creating the profiler to `finish` is recorded as the phase "total".
+    """
+
+    def __init__(self) -> None:
+        self.phases: dict[str, dict[str, float]] = {}
+        self.files: dict[str, dict[str, dict[str, float]]] = {}
+        self.counters: dict[str, int] = {}
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def finish(self):
+        self.phases["total"] = {}
+        self.add_time(
+            self.phases["total"],
+            time.perf_counter() - self.start_wall,
+            time.process_time() - self.start_cpu,
+        )
+
+    @contextmanager
+    def phase(self, name: str, file: str | None = None):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            self.add_time(self.phases.setdefault(name, {}), wall, cpu)
+            if file is not None:
+                file_phases = self.files.setdefault(file, {})
+                self.add_time(file_phases.setdefault(name, {}), wall, cpu)
+
+    def add_time(self, entry: dict[str, float], wall: float, cpu: float):
+        entry["wall"] = entry.get("wall", 0.0) + wall
+        entry["cpu"] = entry.get("cpu", 0.0) + cpu
+        entry["calls"] = entry.get("calls", 0) + 1
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_json(self) -> dict:
+        return {"phases": self.phases, "counters": self.counters, "files": self.files}
+
+    def write(self, path: str):
+        with open(path, "w") as file:
+            json.dump(self.to_json(), file, indent=2)
+
+    def summary(self) -> str:
+        # phases can be nested, so the share is relative to the whole run
+        total = self.phases.get("total", {}).get("wall") or 1.0
+        lines = [f"{'Phase':<16}{'Wall (s)':>10}{'CPU (s)':>10}{'%':>7}{'Calls':>8}"]
+        for name, p in self.phases.items():
+            lines.append(
+                f"{name:<16}{p['wall']:>10.3f}{p['cpu']:>10.3f}"
+                f"{100 * p['wall'] / total:>7.1f}{p['calls']:>8}"
+            )
+        for name, n in self.counters.items():
+            lines.append(f"{name:<26}{n:>10}")
+        return "\n".join(lines)
+
+
+def start_cprofile() -> cProfile.Profile:
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+
+def stop_cprofile(profile: cProfile.Profile, path: str):
+    profile.disable()
+    profile.dump_stats(path)
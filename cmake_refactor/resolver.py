@@ -0,0 +1,90 @@
+import os
+import re
+from functools import cache
+from importlib import resources
+from typing import Optional
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+placeholder_ptrn = re.compile(r"\{(\d+)\}")
+
+
+class Resolver:
+    """
+    Maps external includes to the CMake targets providing them, see
+    `external_targets.toml` for the format of the config.
+
+    Prefixes are indexed by their path components so an include needs at
+    most one lookup per component, results are memoized per header.
+    Includes that match nothing are collected in `unknown` (first path
+    component to includes) instead of failing the run.
+    """
+
+    def __init__(
+        self, prefixes: dict[str, str], contains: dict[str, str] = {}
+    ) -> None:
+        self.prefixes = {
+            tuple(prefix.lower().split("/")): target
+            for prefix, target in prefixes.items()
+        }
+        self.depth = max(map(len, self.prefixes), default=0)
+        self.contains = contains
+        self.targets: dict[str, Optional[str]] = {}
+        self.unknown: dict[str, list[str]] = {}
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "Resolver":
+        """
+        Load the config at `path`, the packaged one if it is None.
+        """
+        if path is None:
+            config = resources.files(__package__) / "external_targets.toml"
+            data = tomllib.loads(config.read_text())
+        else:
+            with open(path, "rb") as file:
+                data = tomllib.load(file)
+        return cls(data.get("prefixes", {}), data.get("contains", {}))
+
+    def resolve(self, header: str) -> Optional[str]:
+        """
+        The target providing `header`, an empty string if none is needed
+        and None if it is unknown.
+        """
+        if header in self.targets:
+            return self.targets[header]
+
+        name = os.path.splitext(header.lower())[0].split("/")
+        target = None
+        for n in range(min(self.depth, len(name)), 0, -1):
+            target = self.prefixes.get(tuple(name[:n]))
+            if target is not None:
+                break
+        else:
+            for part, part_target in self.contains.items():
+                if part in name[0]:
+                    target = part_target
+                    break
+
+        if target is not None:
+            try:
+                target = placeholder_ptrn.sub(lambda m: name[int(m[1])], target)
+            except IndexError:
+                target = None
+        if target is None:
+            self.unknown.setdefault(name[0], []).append(header)
+
+        self.targets[header] = target
+        return target
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{name} (e.g. {headers[0]})" for name, headers in self.unknown.items()
+        )
+
+
+@cache
+def default_resolver() -> Resolver:
+    return Resolver.load()
@@ -0,0 +1,65 @@
+import os
+import shutil
+
+import pytest
+
+from benchmarks.generator import TreeConfig, generate_tree
+from cmake_refactor import io
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+generated_config = TreeConfig(dirs=4, targets_per_dir=2)
+
+
+def read_tree(root: str) -> dict[str, str]:
+    contents = {}
+    for f in io.find_files("CMakeLists.txt", root):
+        with open(f, "r") as file:
+            contents[os.path.relpath(f, root)] = file.read()
+    return contents
+
+
+def update_tree(src_dir: str, repo_root: str, **kwargs) -> dict[str, str]:
+    io.update_links(src_dir, repo_root, dry_run=False, **kwargs)
+    return read_tree(repo_root)
+
+
+def copy_reprex(root) -> str:
+    repo_root = str(root / "reprex")
+    shutil.copytree(os.path.join(current_dir, "reprex"), repo_root)
+    return repo_root
+
+
+@pytest.fixture
+def reprex(tmp_path) -> str:
+    """
+    The repo root of a copy of the reprex tree.
+    """
+    return copy_reprex(tmp_path)
+
+
+@pytest.fixture(scope="session")
+def reprex_updated(tmp_path_factory) -> dict[str, str]:
+    """
+    The CMakeLists.txt of the reprex after an update with the defaults, to
+    compare the results of other options against.
+    """
+    repo_root = copy_reprex(tmp_path_factory.mktemp("reference"))
+    return update_tree("velox", repo_root, cache=False)
+
+
+@pytest.fixture
+def generated(tmp_path) -> tuple[str, str]:
+    """
+    The source dir and repo root of a generated tree.
+    """
+    return generate_tree(str(tmp_path), generated_config), str(tmp_path)
+
+
+@pytest.fixture(scope="session")
+def generated_updated(tmp_path_factory) -> dict[str, str]:
+    """
+    Same as `reprex_updated` for the `generated` tree.
+    """
+    repo_root = str(tmp_path_factory.mktemp("reference"))
+    src_dir = generate_tree(repo_root, generated_config)
+    return update_tree(src_dir, repo_root, cache=False)
@@ -0,0 +1,22 @@
+from benchmarks import __main__ as harness
+from benchmarks.generator import TreeConfig, generate_tree
+from cmake_refactor import io
+
+
+def test_generated_tree(tmp_path):
+    config = TreeConfig(dirs=4, targets_per_dir=2, link_depth=2)
+    src_dir = generate_tree(str(tmp_path), config)
+    files = io.find_files("CMakeLists.txt", str(tmp_path / src_dir))
+    assert len(files) == 5
+
+    io.update_links(src_dir, str(tmp_path), dry_run=False, cache=False)
+    with open(tmp_path / "velox/dir3/CMakeLists.txt") as cml:
+        updated = cml.read()
+    assert "PRIVATE" in updated
+    assert "Folly::folly" in updated
+
+
+def test_run_benchmarks():
+    results = harness.run_benchmarks(TreeConfig(dirs=2, targets_per_dir=1), repeat=1)
+    assert set(results["results"]) == {"parse", "map_local_headers", "update_links"}
+    assert "Ratio" in harness.compare(results, results)
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+from antlr4.error.Errors import CancellationException
+
+from cmake_refactor import cache, io
+
+
+def test_cache_roundtrip(tmp_path):
+    src = tmp_path / "src.cpp"
+    src.write_text('#include "velox/a.h"\n')
+    file_cache = cache.Cache(str(tmp_path / "cache"))
+    assert file_cache.get("includes", str(src)) is None
+    file_cache.put("includes", str(src), io.get_includes(str(src)))
+    file_cache.close()
+
+    file_cache = cache.Cache(str(tmp_path / "cache"))
+    assert file_cache.get("includes", str(src)) == [["velox/a.h"], []]
+
+    # same content but new mtime falls back to the hash
+    os.utime(src, ns=(0, 0))
+    assert file_cache.get("includes", str(src)) == [["velox/a.h"], []]
+    assert file_cache.hits == 2
+
+    src.write_text('#include "velox/b.h"\n')
+    assert file_cache.get("includes", str(src)) is None
+    assert file_cache.misses == 1
+
+
+def test_cache_invalidation(tmp_path, monkeypatch):
+    src = tmp_path / "src.cpp"
+    src.write_text("")
+    file_cache = cache.Cache(str(tmp_path))
+    file_cache.put("includes", str(src), [[], []])
+    file_cache.close()
+
+    monkeypatch.setattr(cache, "tool_version", lambda: "999")
+    file_cache = cache.Cache(str(tmp_path))
+    assert file_cache.get("includes", str(src)) is None
+
+
+def test_cached_update(reprex, tmp_path, capsys):
+    cache_dir = str(tmp_path / "cache")
+
+    io.update_links("velox", reprex, cache_dir=cache_dir)
+    assert "Parsing:" in capsys.readouterr().out
+
+    io.update_links("velox", reprex, dry_run=False, cache_dir=cache_dir)
+    out = capsys.readouterr().out
+    assert "Parsing:" not in out
+    assert "0 misses" in out
+
+    with open(os.path.join(reprex, "velox/io/CMakeLists.txt")) as cml:
+        assert "PRIVATE util" in cml.read()
+
+
+def test_default_cache_dir(reprex, tmp_path):
+    cache_dir = os.path.join(reprex, ".cmr_cache")
+
+    assert cache.open_cache(str(tmp_path / "missing")) is None
+    assert not os.path.exists(tmp_path / "missing")
+
+    io.update_links("velox", reprex)
+    assert not os.path.exists(cache_dir)
+    io.update_links("velox", reprex, dry_run=False)
+    assert os.path.isdir(cache_dir)
+    # dry runs use it once it exists
+    dry_run_cache = cache.open_cache(reprex, create=False)
+    assert dry_run_cache is not None
+    dry_run_cache.close()
+
+
+def test_cache_on_error(reprex, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    broken = os.path.join(reprex, "velox/zz_broken/CMakeLists.txt")
+    os.makedirs(os.path.dirname(broken))
+    with open(broken, "w") as cml:
+        cml.write("add_library(broken a.cpp\n")
+
+    # the commands parsed before the error are still committed
+    with pytest.raises(CancellationException):
+        io.update_links(
+            "velox", reprex, cache_dir=cache_dir, diff=str(tmp_path / "patch")
+        )
+    file_cache = cache.Cache(cache_dir)
+    cml = os.path.join(reprex, "velox/io/CMakeLists.txt")
+    assert file_cache.get("commands", cml) is not None
+    assert file_cache.get("commands", broken) is None
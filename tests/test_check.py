@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from cmake_refactor import check, io
+
+
+def test_check_reprex(reprex, tmp_path, capsys):
+    output = str(tmp_path / "findings.json")
+
+    with pytest.raises(SystemExit) as e:
+        check.check("velox", reprex, cache=False, format="json", output=output)
+    assert e.value.code == 1
+    with open(output) as file:
+        findings = [check.Finding(**f) for f in json.load(file)["findings"]]
+
+    assert {(f.rule, f.file, f.line) for f in findings} == {
+        ("missing-keyword", "velox/io/CMakeLists.txt", 3),
+        ("missing-keyword", "velox/util/CMakeLists.txt", 3),
+        ("scope-mismatch", "velox/io/CMakeLists.txt", 3),
+        ("scope-mismatch", "velox/util/CMakeLists.txt", 3),
+    }
+    mismatch = [f for f in findings if f.rule == "scope-mismatch" and f.target == "io"]
+    assert "io PRIVATE util" in mismatch[0].message
+
+    with pytest.raises(SystemExit):
+        check.check("velox", reprex, cache=False, fail_fast=True)
+    assert "1 findings in 2 files" in capsys.readouterr().out
+
+
+def test_check_after_update(generated, capsys):
+    src_dir, repo_root = generated
+
+    with pytest.raises(SystemExit):
+        check.check(src_dir, repo_root, format="sarif")
+    sarif = json.loads(capsys.readouterr().out)
+    results = sarif["runs"][0]["results"]
+    assert results
+    rules = {r["id"] for r in sarif["runs"][0]["tool"]["driver"]["rules"]}
+    assert {r["ruleId"] for r in results} <= rules
+
+    io.update_links(src_dir, repo_root, dry_run=False)
+    capsys.readouterr()
+    # uses the commands cached by the update
+    check.check(src_dir, repo_root)
+    assert "0 findings in" in capsys.readouterr().out
@@ -0,0 +1,51 @@
+import inspect
+import os
+import subprocess
+import sys
+
+from cmake_refactor import check, cli, daemon, graph, io
+
+# cumulative import time of `cmake_refactor.main` in microseconds
+import_budget = 250_000
+
+
+def test_wrapper_signatures():
+    for wrapper, wrapped in [
+        (cli.update_links, io.update_links),
+        (cli.check, check.check),
+        (cli.analyze, graph.analyze),
+        (cli.serve, daemon.serve),
+        (cli.watch, daemon.watch),
+    ]:
+        assert inspect.signature(wrapper) == inspect.signature(wrapped)
+
+
+def test_import_time():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import cmake_refactor.main"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = {}
+    # "import time: self [us] | cumulative | imported package"
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        modules[name.strip()] = int(cumulative)
+
+    assert "cmake_refactor.cli" in modules
+    # the parser is only loaded by the commands that need it
+    heavy = ("antlr4", "cmake_refactor.parser", "cmake_refactor.io")
+    assert not [m for m in modules if m.startswith(heavy)]
+    assert modules["cmake_refactor.main"] < import_budget
+
+
+def test_update_links_command(tmp_path):
+    from typer.testing import CliRunner
+
+    repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reprex")
+    args = ["update-links", "velox", repo_root, "--cache-dir", str(tmp_path)]
+    result = CliRunner().invoke(cli.cli, args)
+    assert result.exit_code == 0, result.output
+    assert "would be updated" in result.output
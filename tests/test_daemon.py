@@ -0,0 +1,130 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+from benchmarks.generator import TreeConfig, generate_tree
+from cmake_refactor import daemon, io, listeners
+from cmake_refactor.client import send_request
+
+from .test_incremental import prepend
+from .conftest import read_tree
+
+config = TreeConfig(dirs=4, targets_per_dir=2, link_depth=2)
+
+
+def test_session_matches_full_run(tmp_path):
+    base = str(tmp_path / "base")
+    os.makedirs(base)
+    src_dir = generate_tree(base, config)
+    full = str(tmp_path / "full")
+    shutil.copytree(base, full)
+
+    session = daemon.Session(src_dir, base)
+    updated = session.update()
+    io.update_links(src_dir, full, dry_run=False, cache=False)
+    assert read_tree(base) == read_tree(full)
+    assert len(updated) == 4
+    assert session.update() == []
+
+    for root in [base, full]:
+        prepend(
+            os.path.join(root, "velox/dir0/D0T0File0.cpp"),
+            '#include "velox/dir3/D3T1File0.h"\n',
+        )
+
+    assert session.refresh() == {f"{base}/velox/dir0/D0T0File0.cpp"}
+    assert session.update() == [f"{base}/velox/dir0/CMakeLists.txt"]
+    io.update_links(src_dir, full, dry_run=False, cache=False)
+    assert read_tree(base) == read_tree(full)
+    assert session.refresh() == set()
+
+
+def test_server(tmp_path):
+    src_dir = generate_tree(str(tmp_path), config)
+    path = str(tmp_path / "cmr.sock")
+    server = daemon.Server(path, daemon.Session(src_dir, str(tmp_path)), 0.1)
+    thread = threading.Thread(target=server.run)
+    thread.start()
+
+    try:
+        check = send_request(path, {"command": "check"})
+        assert check["ok"] and len(check["changed"]) == 4
+        update = send_request(path, {"command": "update"})
+        assert update["changed"] == check["changed"]
+        assert send_request(path, {"command": "check"})["changed"] == []
+        assert not send_request(path, {"command": "unknown"})["ok"]
+    finally:
+        send_request(path, {"command": "stop"})
+        thread.join()
+
+    assert not os.path.exists(path)
+
+
+def test_syntax_error(tmp_path):
+    src_dir = generate_tree(str(tmp_path), config)
+    session = daemon.Session(src_dir, str(tmp_path))
+    session.update()
+
+    cml = str(tmp_path / "velox/dir0/CMakeLists.txt")
+    with open(cml) as f:
+        text = f.read()
+    # an edit in progress and a change that would update the file
+    broken = text.replace("add_library(velox_d0_t1", "add_library(velox_d0_t1 (")
+    with open(cml, "w") as f:
+        f.write(broken)
+    prepend(
+        str(tmp_path / "velox/dir0/D0T0File0.cpp"),
+        '#include "velox/dir3/D3T1File0.h"\n',
+    )
+
+    with pytest.raises(listeners.ParseFailed, match="CMakeLists.txt line"):
+        session.refresh()
+    with pytest.raises(listeners.ParseFailed):
+        session.update()
+    with open(cml) as f:
+        assert f.read() == broken
+    # not parsed again until it changes
+    with pytest.raises(listeners.ParseFailed):
+        session.refresh()
+
+    with open(cml, "w") as f:
+        f.write(text + "# fixed\n")
+    assert cml in session.refresh()
+    assert session.update() == [cml]
+    with open(cml) as f:
+        assert f.read().endswith("# fixed\n")
+
+
+def test_session_config(tmp_path, capsys):
+    src_dir = generate_tree(str(tmp_path), config)
+    (tmp_path / src_dir / ".gitignore").write_text("dir3/\n")
+    deps_config = tmp_path / "deps.toml"
+    deps_config.write_text('[prefixes]\nfolly = "Folly::folly"\n')
+
+    session = daemon.Session(
+        src_dir, str(tmp_path), ignore_files=True, deps_config=str(deps_config)
+    )
+    assert session.files and not any("/dir3/" in f for f in session.files)
+    capsys.readouterr()
+    session.plan()
+    unknown = capsys.readouterr().out
+    assert "Unknown dependencies: " in unknown and "folly" not in unknown
+
+    # reported for the current tree only, not accumulated across runs
+    session.updated = None
+    session.plan()
+    assert capsys.readouterr().out == unknown
+
+
+def test_session_unlexed_characters(tmp_path):
+    src_dir = generate_tree(str(tmp_path), config)
+    # the lexer drops the backslash, the written text has to keep it
+    with open(str(tmp_path / "velox/dir0/CMakeLists.txt"), "a") as cml:
+        cml.write("set(FLAGS -DX=a\\qb)\n")
+    session = daemon.Session(src_dir, str(tmp_path))
+    session.update()
+    assert session.update(dry_run=True) == []
+    session.updated = None
+    assert session.update(dry_run=True) == []
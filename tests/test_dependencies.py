@@ -0,0 +1,41 @@
+from cmake_refactor import dependencies, listeners
+
+
+def test_resolve_closure():
+    owner = listeners.TargetNode("owner")
+    fmt = listeners.TargetNode("fmt::fmt")
+    index = dependencies.DependencyIndex({"c.h": [owner, owner]})
+    assert list(index["c.h"]) == [owner]
+
+    graph = {
+        "a.h": ([], ["b.h"]),
+        "b.h": ([], ["c.h", "x.h"]),
+        "x.h": ([fmt], ["y.h"]),
+        "y.h": ([], ["x.h", "c.h"]),
+    }
+    scanned = []
+
+    def scan(h):
+        scanned.append(h)
+        return graph[h]
+
+    index.resolve(["a.h", "x.h", "b.h"], scan)
+
+    # every header is only scanned once
+    assert sorted(scanned) == ["a.h", "b.h", "x.h", "y.h"]
+    assert list(index["a.h"]) == [owner, fmt]
+    assert set(index["x.h"]) == {fmt, owner}
+    assert index["x.h"] is index["y.h"]
+    assert index.cycles == [["x.h", "y.h"]]
+
+
+def test_deep_chain():
+    owner = listeners.TargetNode("owner")
+    index = dependencies.DependencyIndex({"h5000": [owner]})
+
+    def scan(h):
+        return [], [f"h{int(h[1:]) + 1}"]
+
+    index.resolve(["h0"], scan)
+    assert list(index["h0"]) == [owner]
+    assert index.cycles == []
@@ -0,0 +1,89 @@
+import os
+
+from cmake_refactor import discovery
+
+
+def make_tree(root, paths: list[str]):
+    for path in paths:
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write("")
+
+
+def find(root, exclude=(), ignore_files=False) -> list[str]:
+    files = discovery.iter_files("CMakeLists.txt", str(root), exclude, ignore_files)
+    return [os.path.relpath(f, root) for f in files]
+
+
+tree = [
+    "CMakeLists.txt",
+    "CMakeLists.txt.orig",
+    "a/CMakeLists.txt",
+    "a/proto/CMakeLists.txt",
+    "a/b/CMakeLists.txt",
+    "build/CMakeLists.txt",
+    "b/build/CMakeLists.txt",
+    "b/CMakeLists.txt",
+]
+
+
+def test_exact_name(tmp_path):
+    make_tree(tmp_path, tree)
+    assert find(tmp_path) == [
+        "CMakeLists.txt",
+        "a/CMakeLists.txt",
+        "a/b/CMakeLists.txt",
+        "a/proto/CMakeLists.txt",
+        "b/CMakeLists.txt",
+        "b/build/CMakeLists.txt",
+        "build/CMakeLists.txt",
+    ]
+
+
+def test_exclude_patterns(tmp_path):
+    make_tree(tmp_path, tree)
+    # plain names match at any depth, like the old excluded dirs
+    assert "a/proto/CMakeLists.txt" not in find(tmp_path, ["proto"])
+    # a leading slash anchors to the root
+    assert find(tmp_path, ["/build"]) == find(tmp_path, ["build", "!b/build"])
+    assert "b/build/CMakeLists.txt" in find(tmp_path, ["/build"])
+    assert find(tmp_path, ["**/b"]) == [
+        "CMakeLists.txt",
+        "a/CMakeLists.txt",
+        "a/proto/CMakeLists.txt",
+        "build/CMakeLists.txt",
+    ]
+    assert find(tmp_path, ["a/*/", "b*/"]) == ["CMakeLists.txt", "a/CMakeLists.txt"]
+
+
+def test_ignore_files(tmp_path):
+    make_tree(tmp_path, ["src/" + p for p in tree])
+    os.makedirs(tmp_path / ".git")
+    (tmp_path / ".gitignore").write_text("# build trees\nbuild/\n")
+    (tmp_path / "src/a/.ignore").write_text("b\n")
+    (tmp_path / "src/b/.gitignore").write_text("!build\n")
+
+    assert find(tmp_path / "src") == find(tmp_path / "src", ignore_files=False)
+    assert find(tmp_path / "src", ignore_files=True) == [
+        "CMakeLists.txt",
+        "a/CMakeLists.txt",
+        "a/proto/CMakeLists.txt",
+        "b/CMakeLists.txt",
+        "b/build/CMakeLists.txt",
+    ]
+    # excludes take precedence
+    assert "b/build/CMakeLists.txt" not in find(
+        tmp_path / "src", ["build"], ignore_files=True
+    )
+
+
+def test_relative_root(tmp_path, monkeypatch):
+    make_tree(tmp_path, tree)
+    monkeypatch.chdir(tmp_path)
+    assert discovery.iter_files("CMakeLists.txt", "a/", ["b"]).__next__() == (
+        "a/CMakeLists.txt"
+    )
+    assert [*discovery.iter_files("CMakeLists.txt", ".", ["a", "b*"])] == [
+        "./CMakeLists.txt"
+    ]
@@ -0,0 +1,91 @@
+import os
+import shutil
+
+import pytest
+
+from benchmarks.generator import TreeConfig, generate_tree
+from cmake_refactor import graph, io, listeners
+
+from .conftest import read_tree
+
+config = TreeConfig(dirs=4, targets_per_dir=2, link_depth=2)
+
+
+def build_targets(src_dir: str, repo_root: str):
+    repo_root = os.path.abspath(repo_root) + "/"
+    targets: dict[str, listeners.TargetNode] = {}
+    hm: dict[str, list[listeners.TargetNode]] = {}
+    for f in io.find_files("CMakeLists.txt", os.path.join(repo_root, src_dir)):
+        io.parse_targets(f, targets, hm, repo_root)
+    io.map_local_headers(targets, hm, repo_root)
+    return targets, hm
+
+
+def node_data(node: listeners.TargetNode):
+    return (
+        node.name,
+        node.is_interface,
+        node.is_object_lib,
+        node.cml_path,
+        None if node.alias_for is None else node.alias_for.name,
+        *[[*getattr(node, f)] for f in graph.file_fields],
+        *[[t.name for t in getattr(node, f)] for f in graph.target_fields],
+    )
+
+
+@pytest.mark.parametrize("ext", ["jsonl", "msgpack"])
+def test_roundtrip(tmp_path, ext):
+    if ext == "msgpack":
+        pytest.importorskip("msgpack")
+    src_dir = generate_tree(str(tmp_path), config)
+    targets, hm = build_targets(src_dir, str(tmp_path))
+    path = str(tmp_path / f"graph.{ext}")
+    graph.write_graph(path, targets, hm, "root/")
+
+    loaded = graph.Graph(path)
+    assert loaded.repo_root == "root/"
+    assert list(loaded) == list(targets)
+    assert len(loaded) == len(targets)
+    for name, node in targets.items():
+        assert node_data(loaded[name]) == node_data(node)
+    loaded_hm = loaded.header_target_map()
+    assert {h: [t.name for t in ts] for h, ts in loaded_hm.items()} == {
+        h: [t.name for t in ts] for h, ts in hm.items()
+    }
+
+
+def test_lazy_nodes(tmp_path):
+    src_dir = generate_tree(str(tmp_path), config)
+    targets, hm = build_targets(src_dir, str(tmp_path))
+    path = str(tmp_path / "graph.jsonl")
+    graph.write_graph(path, targets)
+
+    loaded = graph.Graph(path)
+    name = next(n for n, t in targets.items() if t.private_targets)
+    node = loaded[name]
+    assert loaded.created == {node.id: node}
+    # edges create their nodes, their lists are read when used
+    linked = node.private_targets[0]
+    assert len(loaded.created) > 1
+    with pytest.raises(AttributeError):
+        object.__getattribute__(linked, "_sources")
+    assert node_data(linked) == node_data(targets[linked.name])
+
+
+def test_update_from_graph(tmp_path):
+    base = str(tmp_path / "base")
+    os.makedirs(base)
+    src_dir = generate_tree(base, config)
+    full = str(tmp_path / "full")
+    shutil.copytree(base, full)
+
+    path = str(tmp_path / "graph.jsonl")
+    graph.analyze(src_dir, base, path, cache=False)
+    io.update_links(src_dir, base, dry_run=False, cache=False, graph=path)
+    io.update_links(src_dir, full, dry_run=False, cache=False)
+    assert read_tree(base) == read_tree(full)
+
+    with pytest.raises(ValueError, match="written for"):
+        io.update_links(src_dir, full, graph=path)
+    with pytest.raises(ValueError, match="incremental"):
+        io.update_links(src_dir, base, graph=path, incremental=True)
@@ -0,0 +1,131 @@
+import json
+import io as pyio
+
+import pytest
+
+from cmake_refactor import includes
+
+src = """// Copyright
+/*
+int not_code;
+*/
+#include "velox/a.h"
+#define MACRO(x) \\
+  x + 1
+#include <folly/b.h>
+namespace {
+int a;
+}
+#include "velox/a_impl.h"
+"""
+
+
+def test_read_includes():
+    lines = pyio.StringIO(src)
+    assert includes.read_includes(lines) == ["velox/a.h", "folly/b.h", "velox/a_impl.h"]
+
+
+def test_read_includes_preamble():
+    expected = ["velox/a.h", "folly/b.h"]
+    assert includes.read_includes(pyio.StringIO(src), True) == expected
+    cases = {
+        # code in a conditional block doesn't end the preamble
+        "#if X\nint a;\n#endif\n#include <a.h>\nint b;\n#include <b.h>\n": ["a.h"],
+        # an include guard is not a conditional block
+        "#ifndef A_H\n#define A_H\n#include <a.h>\nint a;\n#include <b.h>\n#endif\n": [
+            "a.h"
+        ],
+        "#ifndef A_H\n#define B_H\n#include <a.h>\nint a;\n#include <b.h>\n#endif\n": [
+            "a.h",
+            "b.h",
+        ],
+        "# ifdef X\nint a;\n# endif\n/* int b; */\n#include <b.h>\n": ["b.h"],
+    }
+    for text, expected in cases.items():
+        assert includes.read_includes(pyio.StringIO(text), True) == expected, text
+
+
+def test_streaming_stops_reading(tmp_path):
+    path = tmp_path / "large.cpp"
+    path.write_text('#include "velox/a.h"\n' + "int a;\n" * 100000)
+    with open(path, "r") as file:
+        assert includes.read_includes(file, True) == ["velox/a.h"]
+        assert file.buffer.raw.tell() < path.stat().st_size
+
+
+def test_read_depfile(tmp_path):
+    depfile = tmp_path / "a.o.d"
+    depfile.write_text(
+        "a.o: /src/a.cpp /src/my\\ dir/a.h \\\n  /usr/include/stdio.h\n/src/my\\ dir/a.h:\n"
+    )
+    assert includes.read_depfile(str(depfile)) == [
+        "/src/a.cpp",
+        "/src/my dir/a.h",
+        "/usr/include/stdio.h",
+    ]
+
+
+@pytest.mark.parametrize("flag", ["-MD", "-MMD"])
+def test_compile_commands(tmp_path, flag):
+    repo_root = tmp_path / "repo"
+    deps = tmp_path / "deps"
+    build = tmp_path / "build"
+    build.mkdir()
+    source = repo_root / "velox/io/io.cpp"
+    source.parent.mkdir(parents=True)
+    source.write_text(
+        '#include "velox/util/util.h"\n#include <folly/Format.h>\n'
+        "#include <folly/String.h>\n#include <stdio.h>\n"
+        '#ifdef _WIN32\n#include "velox/io/win.h"\n#include <windows.h>\n#endif\n'
+    )
+    # util.h includes detail.h, folly/String.h is in a default include dir,
+    # -MMD leaves out the system headers
+    depfile = f"io.cpp.o: {source} {repo_root}/velox/util/util.h "
+    depfile += f"{repo_root}/velox/util/detail.h"
+    if flag == "-MD":
+        depfile += f" {deps}/folly/Format.h /usr/local/include/folly/String.h"
+        depfile += " /usr/include/stdio.h"
+    (build / "io.cpp.o.d").write_text(depfile + "\n")
+    command = (
+        f"c++ -I{repo_root} -isystem {deps} {flag} -MF io.cpp.o.d -o io.cpp.o "
+        f"-c {source}"
+    )
+    db = tmp_path / "compile_commands.json"
+    db.write_text(
+        json.dumps([{"directory": str(build), "command": command, "file": str(source)}])
+    )
+
+    compile_commands = includes.CompileCommands(str(db))
+    deps_h = ["folly/Format.h", "folly/String.h", "stdio.h"]
+    if flag == "-MMD":
+        deps_h.append("windows.h")
+    expected = (["velox/util/util.h"], deps_h)
+    scanned = includes.get_includes(str(source))
+    assert compile_commands.filter(str(source), scanned) == expected
+    assert compile_commands.filter(str(repo_root / "other.cpp"), scanned) is None
+
+    scanner = includes.IncludeScanner(compile_commands=compile_commands)
+    assert scanner.get_includes(str(source)) == expected
+    assert scanner.compile_hits == 1
+
+
+def test_prefetch(tmp_path):
+    files = []
+    for i in range(20):
+        path = tmp_path / f"f{i}.cpp"
+        path.write_text(f'#include "velox/h{i}.h"\n#include <folly/f{i}.h>\n')
+        files.append(str(path))
+    missing = str(tmp_path / "missing.cpp")
+
+    scanner = includes.IncludeScanner(threads=4, max_pending=3)
+    scanner.prefetch([*files, missing, *files])
+    assert scanner.include_misses == 21
+    assert scanner.files_read == 20
+    for i, f in enumerate(files):
+        assert scanner.get_includes(f) == ([f"velox/h{i}.h"], [f"folly/f{i}.h"])
+    assert scanner.include_misses == 21
+    assert scanner.files_read == 20
+
+    # unreadable files raise where they are used
+    with pytest.raises(FileNotFoundError):
+        scanner.get_includes(missing)
@@ -0,0 +1,133 @@
+import os
+import shutil
+
+from benchmarks.generator import TreeConfig, generate_tree
+from cmake_refactor import io
+from cmake_refactor.incremental import RunState
+
+from .conftest import read_tree
+
+config = TreeConfig(dirs=4, targets_per_dir=2, link_depth=2)
+
+
+def setup_trees(tmp_path):
+    # a tree that was updated before and a copy of it to compare against
+    base = str(tmp_path / "base")
+    os.makedirs(base)
+    src_dir = generate_tree(base, config)
+    io.update_links(src_dir, base, dry_run=False)
+    full = str(tmp_path / "full")
+    shutil.copytree(base, full, ignore=shutil.ignore_patterns(".cmr_cache"))
+    return src_dir, base, full
+
+
+def append(path: str, text: str):
+    with open(path, "a") as file:
+        file.write(text)
+
+
+def prepend(path: str, text: str):
+    # includes after the first line of code are not read
+    with open(path, "r+") as file:
+        rest = file.read()
+        file.seek(0)
+        file.write(text + rest)
+
+
+def updated_files(output: str) -> list[str]:
+    return [line for line in output.splitlines() if line.startswith("Updating:")]
+
+
+def test_incremental_matches_full_run(tmp_path, capsys):
+    src_dir, base, full = setup_trees(tmp_path)
+    # a header without owner, only used by a target of another directory
+    header = "velox/extra/Extra.h"
+    for root in [base, full]:
+        os.makedirs(os.path.join(root, "velox/extra"))
+        append(os.path.join(root, header), "#pragma once\n")
+        prepend(
+            os.path.join(root, "velox/dir2/D2T0File0.cpp"), f'#include "{header}"\n'
+        )
+    io.update_links(src_dir, base, dry_run=False)
+
+    # the first target now uses a header of a target in another directory
+    source = "velox/dir0/D0T0File0.cpp"
+    for root in [base, full]:
+        prepend(os.path.join(root, source), '#include "velox/dir3/D3T1File0.h"\n')
+
+    capsys.readouterr()
+    io.update_links(src_dir, base, dry_run=False, incremental=True)
+    output = capsys.readouterr().out
+    io.update_links(src_dir, full, dry_run=False, cache=False)
+
+    assert read_tree(base) == read_tree(full)
+    assert "velox_d3_t1" in read_tree(base)["velox/dir0/CMakeLists.txt"]
+    assert "Incremental: 1 changed files" in output
+    assert len(updated_files(output)) == 1
+
+    # the header was not read by the last run but is still watched
+    for root in [base, full]:
+        append(os.path.join(root, header), '#include "velox/dir3/D3T1File0.h"\n')
+
+    io.update_links(src_dir, base, dry_run=False, incremental=True)
+    output = capsys.readouterr().out
+    io.update_links(src_dir, full, dry_run=False, cache=False)
+
+    assert read_tree(base) == read_tree(full)
+    assert "velox_d3_t1" in read_tree(base)["velox/dir2/CMakeLists.txt"]
+    assert "Incremental: 1 changed files" in output
+
+
+def test_incremental_changed_cml(tmp_path, capsys):
+    src_dir, base, full = setup_trees(tmp_path)
+    # a header moves to a new target, its users have to link against it
+    for root in [base, full]:
+        append(
+            os.path.join(root, "velox/dir0/CMakeLists.txt"),
+            "\nadd_library(velox_d0_extra D0T0File1.h)\n"
+            "target_link_libraries(velox_d0_extra Folly::folly)\n",
+        )
+
+    capsys.readouterr()
+    io.update_links(
+        src_dir, base, dry_run=False, changed=[f"{base}/velox/dir0/CMakeLists.txt"]
+    )
+    output = capsys.readouterr().out
+    io.update_links(src_dir, full, dry_run=False, cache=False)
+
+    assert read_tree(base) == read_tree(full)
+    assert len(updated_files(output)) < len(read_tree(base)) - 1
+
+
+def test_incremental_without_state(tmp_path, capsys):
+    repo_root = str(tmp_path)
+    src_dir = generate_tree(repo_root, config)
+    io.update_links(src_dir, repo_root, incremental=True)
+    output = capsys.readouterr().out
+    assert "no previous run found" in output
+    # velox/CMakeLists.txt only adds subdirectories
+    assert len(updated_files(output)) == 4
+
+
+def test_run_state_roundtrip(tmp_path):
+    repo_root = str(tmp_path) + "/"
+    src_dir = generate_tree(repo_root, config)
+    targets = {}
+    hm = {}
+    for f in io.find_files("CMakeLists.txt", repo_root + src_dir):
+        io.parse_targets(f, targets, header_target_map=hm, repo_root=repo_root)
+    index = io.dependencies.DependencyIndex(hm)
+    io.map_local_headers(targets, index, repo_root)
+
+    state = RunState()
+    state.update(targets, {}, index, repo_root)
+    state = RunState(state.to_json())
+    assert state.changed_files([]) == set()
+
+    header = repo_root + "velox/dir0/D0T0File0.h"
+    append(header, "\n")
+    assert state.changed_files([]) == {header}
+    affected = state.affected_targets({header}, targets, {}, repo_root)
+    assert "velox_d0_t0" in affected
+    # users of the header in the next layer
+    assert any(name.startswith(("velox_d2", "velox_d3")) for name in affected)
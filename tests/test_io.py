@@ -1,8 +1,15 @@
+import json
 import os
+import subprocess
 import tempfile
 
+import pytest
+from antlr4.error.Errors import CancellationException
+
 from cmake_refactor import io, listeners
 
+from .conftest import read_tree, update_tree
+
 current_dir = os.path.dirname(os.path.abspath(__file__))
 cml = os.path.join(current_dir, "files/CMakeLists.txt")
 velox_dir = os.path.join(current_dir, "velox/velox")
@@ -91,11 +98,13 @@ def test_header_map():
 
 
 def test_full_update():
-    io.update_links("velox/", os.path.dirname(velox_dir), ["proto","external"])
+    io.update_links(
+        "velox/", os.path.dirname(velox_dir), ["proto", "external"], cache=False
+    )
 
 
 def test_full_update_reprex():
-    io.update_links("velox", os.path.join(current_dir, "reprex/"))
+    io.update_links("velox", os.path.join(current_dir, "reprex/"), cache=False)
 
 
 def test_reprex():
@@ -130,3 +139,300 @@ def test_reprex():
     updated_cml = update_listener.token_stream.getText("default", 0, 999999999)
     print(updated_cml)
     assert "PRIVATE util" in updated_cml
+
+
+@pytest.mark.parametrize("mb", [512, 0])
+def test_parse_cache_fallback(reprex, reprex_updated, mb):
+    # without space for token streams the rewrite pass has to lex again
+    assert update_tree("velox", reprex, parse_cache_mb=mb) == reprex_updated
+    assert "PRIVATE util" in reprex_updated["velox/io/CMakeLists.txt"]
+
+
+def test_parse_commands():
+    parsed = io.ParseCache(max_mb=0)
+    commands = parsed.parse(cml)
+    assert [c.kind for c in commands].count("add_target") == 6
+    assert commands[2].command == "target_link_libraries"
+    assert commands[2].args[0] == "velox_exception"
+
+    stream, cached = parsed.get(cml)
+    assert cached is commands
+    assert stream.getText(0, commands[2].stop).startswith("# Copyright")
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_parallel_update(reprex, reprex_updated, jobs):
+    assert update_tree("velox", reprex, jobs=jobs) == reprex_updated
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_parallel_scan(generated, generated_updated, threads):
+    src_dir, repo_root = generated
+    result = update_tree(src_dir, repo_root, cache=False, scan_threads=threads)
+    assert result == generated_updated
+
+
+def test_parse_file_fragment():
+    # the per file results of the workers have to be replayable in order
+    targets = {}
+    listener = listeners.TargetInputListener(targets)
+    listener.replay(io.parse_file(cml), cml)
+
+    expected = {}
+    io.walk_stream(io.get_token_stream(cml), listeners.TargetInputListener(expected))
+    assert list(targets) == list(expected)
+    assert [t.name for t in targets["velox_exception"].ppublic_targets] == [
+        t.name for t in expected["velox_exception"].ppublic_targets
+    ]
+
+
+def test_include_scanner():
+    file = os.path.join(current_dir, "files/BitUtil.cpp")
+    scanner = io.IncludeScanner()
+    assert scanner.get_includes(file) == io.get_includes(file)
+    assert scanner.get_includes(file) is scanner.get_includes(file)
+    assert scanner.local_headers(current_dir + "/files") == frozenset()
+    scanner.local_headers(current_dir + "/files")
+    assert (scanner.include_hits, scanner.include_misses) == (2, 1)
+    assert (scanner.header_hits, scanner.header_misses) == (1, 1)
+
+
+def test_update_with_compile_commands(reprex, tmp_path):
+    source = os.path.join(reprex, "velox/io/io.cpp")
+    with open(source, "w") as f:
+        f.write('#ifdef USE_UTIL\n#include "velox/util/util.h"\n#endif\n')
+    build = tmp_path / "build"
+    build.mkdir()
+    # built without USE_UTIL
+    (build / "io.o.d").write_text(f"io.o: {source}\n")
+    command = f"c++ -I{reprex} -MD -MF io.o.d -o io.o -c {source}"
+    db = tmp_path / "compile_commands.json"
+    db.write_text(
+        json.dumps([{"directory": str(build), "command": command, "file": source}])
+    )
+
+    io.update_links(
+        "velox", reprex, dry_run=False, cache=False, compile_commands=str(db)
+    )
+    with open(os.path.join(reprex, "velox/io/CMakeLists.txt")) as cml:
+        assert "PRIVATE util" not in cml.read()
+
+    io.update_links("velox", reprex, dry_run=False, cache=False)
+    with open(os.path.join(reprex, "velox/io/CMakeLists.txt")) as cml:
+        assert "PRIVATE util" in cml.read()
+
+
+def test_may_have_targets(tmp_path):
+    assert io.may_have_targets(cml)
+    cases = {
+        "add_subdirectory(velox)\nset(X ON)\n": False,
+        "velox_add_library(foo foo.cpp)\n": False,
+        "ADD_LIBRARY (foo foo.cpp)\n": True,
+        "if(X)\n  target_link_libraries(foo bar)\nendif()\n": True,
+        "# add_executable is only mentioned here\n": True,
+    }
+    for text, expected in cases.items():
+        file = tmp_path / "CMakeLists.txt"
+        file.write_text(text)
+        assert io.may_have_targets(str(file)) == expected
+
+
+def test_update_skips_files_without_targets(reprex, capsys):
+    with open(os.path.join(reprex, "velox/CMakeLists.txt"), "w") as cml:
+        cml.write("add_subdirectory(io)\nadd_subdirectory(util)\n")
+
+    io.update_links("velox", reprex, dry_run=False, cache=False)
+    output = capsys.readouterr().out
+    assert "Parsing: " + os.path.join(reprex, "velox/CMakeLists.txt") not in output
+    assert "files skipped" in output
+    assert "PRIVATE util" in read_tree(reprex)["velox/io/CMakeLists.txt"]
+
+
+def test_parse_stream_matches_ll():
+    stream = io.get_token_stream(cml)
+    parser = io.CMakeParser(stream)
+    expected = parser.cmake_file().toStringTree(recog=parser)
+
+    # the parser is reused between files
+    for _ in range(2):
+        stream = io.get_token_stream(cml)
+        assert io.parse_stream(stream).toStringTree(recog=parser) == expected
+
+
+def test_parse_stream_syntax_error(tmp_path):
+    file = tmp_path / "CMakeLists.txt"
+    file.write_text("add_library(foo a.cpp\ntarget_link_libraries(foo bar)\n")
+    with pytest.raises(CancellationException, match="line 2:0"):
+        io.parse_commands(io.get_token_stream(str(file)))
+    # a failed parse does not affect the next file
+    assert len(io.parse_commands(io.get_token_stream(cml))) > 0
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_keep_going(reprex, capsys, jobs):
+    broken = os.path.join(reprex, "velox/broken/CMakeLists.txt")
+    os.makedirs(os.path.dirname(broken))
+    with open(broken, "w") as cml:
+        cml.write("add_library(broken a.cpp\ntarget_link_libraries(broken b)\n")
+    original = read_tree(reprex)
+
+    with pytest.raises(SystemExit) as exit:
+        io.update_links("velox", reprex, dry_run=False, jobs=jobs, keep_going=True)
+    assert exit.value.code == 1
+    output = capsys.readouterr().out
+    assert f"{broken} line 2:0 " in output
+    assert "1 syntax errors in 1 files" in output
+    assert read_tree(reprex) == original
+
+
+def test_keep_going_dependency(generated, capsys):
+    # the targets of the broken file are used by the other directories
+    src_dir, repo_root = generated
+    update_tree(src_dir, repo_root, cache=False)
+    broken = os.path.join(repo_root, "velox/dir0/CMakeLists.txt")
+    with open(broken, "a") as cml:
+        cml.write("add_library(broken a.cpp\n")
+    original = read_tree(repo_root)
+    capsys.readouterr()
+
+    with pytest.raises(SystemExit):
+        io.update_links(src_dir, repo_root, dry_run=False, keep_going=True)
+    assert "Updating:" not in capsys.readouterr().out
+    assert read_tree(repo_root) == original
+
+
+def test_include_preamble(reprex):
+    # an implementation header included after the declarations
+    with open(os.path.join(reprex, "velox/util/util.h"), "a") as header:
+        header.write('int util();\n#include "velox/util/util_inl.h"\n')
+    with open(os.path.join(reprex, "velox/util/util_inl.h"), "w") as header:
+        header.write("#include <folly/Range.h>\n")
+
+    cml = "velox/util/CMakeLists.txt"
+    assert "Folly::folly" not in update_tree(
+        "velox", reprex, cache=False, include_preamble=True
+    )[cml]
+    assert "Folly::folly" in update_tree("velox", reprex, cache=False)[cml]
+
+
+def test_update_skips_unchanged_files(reprex, capsys):
+    io.update_links("velox", reprex, dry_run=False, cache=False)
+    assert "Updated 2 files, 0 unchanged" in capsys.readouterr().out
+
+    mtimes = {f: os.stat(f).st_mtime_ns for f in io.find_files("CMakeLists.txt", reprex)}
+    io.update_links("velox", reprex, dry_run=False, cache=False)
+    assert "Updated 0 files, 2 unchanged" in capsys.readouterr().out
+    assert mtimes == {f: os.stat(f).st_mtime_ns for f in mtimes}
+
+
+def test_write_file(tmp_path):
+    path = tmp_path / "CMakeLists.txt"
+    path.write_text("old")
+    path.chmod(0o640)
+    io.write_file(str(path), "new")
+    assert path.read_text() == "new"
+    assert path.stat().st_mode & 0o777 == 0o640
+    assert os.listdir(tmp_path) == ["CMakeLists.txt"]
+
+    writer = io.FileWriter(threads=2, max_pending=1)
+    for i in range(4):
+        writer.write(str(tmp_path / f"{i}.txt"), str(i))
+    writer.write(str(tmp_path / "missing" / "x.txt"), "")
+    with pytest.raises(FileNotFoundError):
+        writer.close()
+    assert (tmp_path / "3.txt").read_text() == "3"
+
+
+def test_diff_applies(reprex, tmp_path, capsys):
+    with open(os.path.join(reprex, "velox/io/CMakeLists.txt"), "a") as cml:
+        cml.write("# no newline at the end")
+    util_cml = os.path.join(reprex, "velox/util/CMakeLists.txt")
+    with open(util_cml, "rb") as file:
+        text = file.read()
+    with open(util_cml, "wb") as file:
+        file.write(text.replace(b"\n", b"\r\n"))
+    subprocess.run(["git", "init", "-q"], cwd=reprex, check=True)
+    patch = str(tmp_path / "links.patch")
+
+    io.update_links("velox", reprex, cache=False, diff=patch)
+    original = read_tree(reprex)
+    with open(patch) as file:
+        assert file.read().startswith("diff --git a/velox/")
+
+    capsys.readouterr()
+    io.update_links("velox", reprex, cache=False, diff="-")
+    stdout = capsys.readouterr().out
+    with open(patch, newline="") as file:
+        assert stdout == file.read()
+
+    subprocess.run(["git", "apply", patch], cwd=reprex, check=True)
+    patched = read_tree(reprex)
+    assert patched != original
+    with open(util_cml, "rb") as file:
+        patched_util = file.read()
+    assert b"PUBLIC io)\r\n" in patched_util
+    io.update_links("velox", reprex, dry_run=False, cache=False)
+    assert read_tree(reprex) == patched
+    with open(util_cml, "rb") as file:
+        assert file.read() == patched_util
+
+
+def rewriter_text(stream, edits):
+    rewriter = io.ant.TokenStreamRewriter.TokenStreamRewriter(stream)
+    for edit in edits:
+        edit.apply(rewriter)
+    return rewriter.getText("default", 0, len(stream.tokens) - 1)
+
+
+def test_apply_edits_matches_rewriter():
+    stream = io.get_token_stream(cml)
+    stream.fill()
+    commands = io.parse_commands(stream)
+    TokenEdit = listeners.TokenEdit
+    cases = [
+        [],
+        [TokenEdit("replace", c.start + 2, c.stop - 1, "x PUBLIC y") for c in commands],
+        [
+            TokenEdit("insert_after", commands[2].start + 3, 0, "PUBLIC "),
+            TokenEdit("replace", commands[0].start, commands[0].stop, ""),
+            TokenEdit("insert_after", commands[0].stop, 0, "# after\n"),
+            TokenEdit("replace", commands[0].stop + 1, commands[1].start, "\n"),
+        ],
+        # overlapping edits are left to the rewriter
+        [
+            TokenEdit("replace", commands[0].start, commands[0].stop, "a"),
+            TokenEdit("replace", commands[0].start, commands[1].stop, "b"),
+        ],
+        [
+            TokenEdit("insert_after", commands[1].start, 0, "a"),
+            TokenEdit("insert_after", commands[1].start, 0, "b"),
+        ],
+    ]
+    for edits in cases:
+        assert io.apply_edits(stream, edits) == rewriter_text(stream, edits)
+
+
+def test_parse_texts():
+    with open(cml) as file:
+        text = file.read()
+
+    # the same file at two virtual paths, e.g. two revisions of it
+    files = ((f"/rev{i}/velox/common/base/CMakeLists.txt", text) for i in range(2))
+    hm = {}
+    targets = io.parse_texts(files, header_target_map=hm, repo_root="/rev0/")
+
+    expected = io.parse_targets(cml, {})
+    assert list(targets) == list(expected)
+    target = targets["velox_exception"]
+    assert target.cml_path == "/rev1/velox/common/base"
+    assert list(target.sources) == [
+        f"/rev{i}/velox/common/base/{f}"
+        for i in range(2)
+        for f in ["Exceptions.cpp", "VeloxException.cpp"]
+    ]
+    assert hm["velox/common/base/Exceptions.h"] == [target]
+
+
+def test_parse_texts_syntax_error():
+    with pytest.raises(CancellationException, match="in/memory/CMakeLists.txt line 1"):
+        io.parse_texts([("in/memory/CMakeLists.txt", "add_library(foo")])
@@ -1,5 +1,7 @@
 import os
 
+import pytest
+
 from cmake_refactor import io, listeners
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -92,3 +94,35 @@ def test_link_replacement():
     updated_cml = update_listener.token_stream.getText("default", 0, 999999999)
     print(updated_cml)
     assert "PUBLIC" in updated_cml
+
+
+def test_target_node_compat():
+    target = listeners.TargetNode("target", sources=["a.cpp", "a.cpp", "b.cpp"])
+    other = listeners.TargetNode("other")
+    assert list(target.sources) == ["a.cpp", "b.cpp"]
+    assert "b.cpp" in target.sources and "c.cpp" not in target.sources
+
+    # edges are deduplicated but keep their order
+    target.public_targets.extend([other, target, other])
+    assert target.public_targets[0] is other
+    assert target.public_targets + target.private_targets == [other, target]
+
+    # assigning a list keeps the set semantics
+    target.cpp_includes = ["velox/a.h", "velox/a.h"]
+    assert len(target.cpp_includes) == 1
+
+    other_sources = listeners.TargetNode("other_sources", sources=["a.cpp"])
+    assert other_sources.sources.items.keys() == target.sources.items.keys() - {
+        listeners.paths.id("b.cpp")
+    }
+    assert not hasattr(target, "__dict__")
+
+
+def test_ordered_set():
+    items = listeners.OrderedSet(["a", "b", "a"])
+    assert items == ["a", "b"] and items[0] == "a" and items[-1] == "b"
+    assert items != None and items != 1
+    with pytest.raises(IndexError):
+        listeners.OrderedSet()[0]
+    with pytest.raises(IndexError):
+        items[2]
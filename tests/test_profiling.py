@@ -0,0 +1,43 @@
+import json
+import os
+import pstats
+
+from cmake_refactor import io, profiling
+
+
+def test_profiler():
+    profiler = profiling.Profiler()
+    for file in ["a", "b"]:
+        with profiler.phase("parse", file):
+            profiler.count("tokens", 2)
+    profiler.finish()
+
+    assert profiler.phases["parse"]["calls"] == 2
+    assert profiler.files["b"]["parse"]["calls"] == 1
+    assert profiler.counters["tokens"] == 4
+    assert "parse" in profiler.summary()
+
+
+def test_update_profile(reprex, tmp_path):
+    profile = str(tmp_path / "profile.json")
+    cprofile = str(tmp_path / "profile.pstats")
+    io.update_links("velox", reprex, cache=False, profile=profile, cprofile=cprofile)
+
+    with open(profile) as file:
+        data = json.load(file)
+    assert {"lex", "parse", "dependencies", "rewrite", "total"} <= set(data["phases"])
+    assert data["counters"]["files parsed"] == 2
+    assert data["counters"]["targets rewritten"] == 2
+    assert os.path.join(reprex, "velox/io/CMakeLists.txt") in data["files"]
+    pstats.Stats(cprofile)
+
+
+def test_files_scanned(reprex, tmp_path):
+    profile = str(tmp_path / "profile.json")
+    cache_dir = str(tmp_path / "cache")
+    for expected in [True, False]:
+        io.update_links("velox", reprex, cache_dir=cache_dir, profile=profile)
+        with open(profile) as file:
+            counters = json.load(file)["counters"]
+        # includes found in the cache are not counted
+        assert bool(counters.get("files scanned")) == expected
@@ -0,0 +1,51 @@
+import pytest
+
+from cmake_refactor import io
+from cmake_refactor.resolver import Resolver, default_resolver
+
+# results of the former hardcoded `get_dep_name`
+known = {
+    "snappy.h": "Snappy::snappy",
+    "folly/synchronization/AtomicStruct.h": "Folly::folly",
+    "boost/algorithm/string.hpp": "Boost::headers",
+    "boost/Regex.hpp": "Boost::regex",
+    "boost/filesystem/path.hpp": "Boost::filesystem",
+    "aws/core/Aws.h": "${AWSSDK_LIBRARIES}",
+    "zstd.h": "zstd::zstd",
+    "stdint.h": "",
+    "immintrin.h": "",
+    "sys/mman.h": "",
+    "gtest/gtest.h": "gtest",
+}
+
+
+def test_default_config():
+    resolver = Resolver.load()
+    for header, target in known.items():
+        assert resolver.resolve(header) == target
+    assert resolver.unknown == {}
+
+
+def test_unknown(tmp_path):
+    config = tmp_path / "deps.toml"
+    config.write_text(
+        '[prefixes]\nfoo = "Foo::{1}"\n"foo/util" = "Foo::foo"\n'
+        '[contains]\nstd = ""\n'
+    )
+    resolver = Resolver.load(str(config))
+    assert resolver.resolve("foo/util/a.h") == "Foo::foo"
+    assert resolver.resolve("foo/bar/a.h") == "Foo::bar"
+    assert resolver.resolve("cstdlib") == ""
+    assert resolver.resolve("folly/Range.h") is None
+    assert resolver.resolve("folly/Range.h") is None
+    # the placeholder needs a second component
+    assert resolver.resolve("foo.h") is None
+    assert resolver.unknown == {"folly": ["folly/Range.h"], "foo": ["foo.h"]}
+    assert resolver.summary() == "folly (e.g. folly/Range.h), foo (e.g. foo.h)"
+
+
+def test_get_dep_name():
+    assert io.get_dep_name("glog/logging.h") == "glog::glog"
+    with pytest.raises(Exception, match="unmatched dependency"):
+        io.get_dep_name("unknown/header.h")
+    assert "unknown" in default_resolver().unknown